@@ -0,0 +1,99 @@
+"""The customer profile and order status pages, for both apps.
+
+app.py serves them from Flask on one pooled connection, and asgi.py from
+Quart, running the independent statements concurrently. Both run the
+statements here and build their answers with the helpers below, so the two
+cannot drift apart; only how the statements are executed differs.
+"""
+from psycopg import sql
+
+PROFILE_TEMPLATE = "account/profile.html"
+ORDER_TEMPLATE = "account/order.html"
+
+# Orders shown on each page of a profile.
+PER_PAGE = 10
+
+CUSTOMER = """
+    SELECT * FROM customer WHERE cust_no = %(cust_no)s;
+"""
+
+# A customer's orders with their totals and whether they are paid, for
+# pagination.fetch_page; orders_cust_no_date serves it a page at a time.
+ORDER_HISTORY = """
+    (SELECT o.order_no, o.date, o.item_count, o.order_total,
+            pay.order_no IS NOT NULL AS paid
+     FROM orders o
+     LEFT JOIN pay USING (order_no)
+     WHERE o.cust_no = %(cust_no)s) AS history
+"""
+
+# The lines of an order, priced as they were sold.
+ORDER_LINES = """
+    SELECT p.name, p.sku, c.qty, c.qty*coalesce(c.unit_price, p.price) as total_p
+    FROM contains c
+    JOIN product p USING (sku)
+    WHERE order_no = %(order_no)s;
+"""
+
+# The total of an order and whether the customer paid it.
+ORDER_TOTAL = """
+    SELECT o.order_total, pay.order_no IS NOT NULL AS paid
+    FROM orders o
+    LEFT JOIN pay ON pay.order_no = o.order_no AND pay.cust_no = %(cust_no)s
+    WHERE o.order_no = %(order_no)s;
+"""
+
+
+def wants_json(request):
+    """Whether ``request`` asks for JSON explicitly (e.g., fetch) rather
+    than for the HTML page."""
+
+    return bool(
+        request.accept_mimetypes["application/json"]
+        and not request.accept_mimetypes["text/html"]
+    )
+
+
+def history(cust_no, args):
+    """The arguments, after the cursor, of pagination.fetch_page() or
+    fetch_page_async() for the page of orders of ``cust_no`` that the query
+    string ``args`` asks for."""
+
+    return {
+        "table": sql.SQL(ORDER_HISTORY),
+        "columns": ("order_no", "date", "item_count", "order_total", "paid"),
+        "keys": ("date", "order_no"),
+        "after": args.get("after"),
+        "page": int(args.get("page", 1)),
+        "per_page": PER_PAGE,
+        "params": {"cust_no": cust_no},
+        "descending": True,
+    }
+
+
+def profile(customer_info, page):
+    """The JSON body of a profile."""
+
+    return {
+        "customer": customer_info._asdict(),
+        "orders": [order._asdict() for order in page.rows],
+    }
+
+
+def profile_page(customer_info, page):
+    """The variables of PROFILE_TEMPLATE."""
+
+    return {"customer_orders": page.rows, "customer_info": customer_info, "page": page}
+
+
+def order_page(cust_no, order_no, contains, order):
+    """The variables of ORDER_TEMPLATE, from the ORDER_LINES rows and the
+    ORDER_TOTAL row (None if there is no such order)."""
+
+    return {
+        "contains": contains,
+        "paid": order is not None and order.paid,
+        "order_total": order.order_total if order is not None else None,
+        "order_no": order_no,
+        "cust_no": cust_no,
+    }
@@ -0,0 +1,157 @@
+"""Sales rollups over the product_sales fact table, for dashboards.
+
+The two analyses of the E3 report, with the year and the dimensions as
+parameters. Results are kept in an in-process LRU keyed by the version of
+product_sales (see migrations/006_sales_version.sql) and the parameters,
+so they are computed again only after sales changed.
+"""
+import collections
+import datetime
+import os
+import threading
+
+from psycopg import sql
+from psycopg.rows import dict_row
+
+# Most results kept; the least recently used go first.
+SIZE = int(os.environ.get("ANALYTICS_SIZE", 64))
+
+# Dimension name: product_sales column, for the sales per SKU.
+SALES = {
+    "city": "city",
+    "month": "month",
+    "day": "day_of_month",
+    "weekday": "day_of_week",
+}
+
+# Dimension name: calendar column, for the average daily sales.
+DAILY = {
+    "month": "month",
+    "weekday": "weekday",
+}
+
+# How the dimensions whose values do not sort by themselves are ordered:
+# weekdays by their number, Sunday first, rather than by name. Every group
+# of one weekday has the same number.
+SALES_ORDER = {"weekday": sql.SQL("min(extract(dow from date))")}
+DAILY_ORDER = {"weekday": sql.SQL("min(weekday_order)")}
+
+_entries = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def params(args, dimensions):
+    """The year and dimensions asked for in the query string ``args``.
+
+    Raises ValueError for a year that is not a number or an unknown
+    dimension.
+    """
+
+    year = int(args.get("year", datetime.date.today().year))
+    by = args.get("by")
+    by = tuple(dict.fromkeys(by.split(","))) if by else tuple(dimensions)
+    unknown = [name for name in by if name not in dimensions]
+    if unknown:
+        raise ValueError(
+            f"Unknown dimension {', '.join(unknown)}; use {', '.join(dimensions)}."
+        )
+    return year, by
+
+
+def _cached(key, compute):
+    with _lock:
+        if key in _entries:
+            _entries.move_to_end(key)
+            return _entries[key]
+    result = compute()
+    with _lock:
+        _entries[key] = result
+        while len(_entries) > SIZE:
+            _entries.popitem(last=False)
+    return result
+
+
+def _rollup(columns, by):
+    """The name of the dimension each row of the rollup is grouped by."""
+
+    return sql.SQL("CASE {} ELSE 'all' END").format(
+        sql.SQL(" ").join(
+            sql.SQL("WHEN GROUPING({}) = 0 THEN {}").format(
+                sql.Identifier(columns[name]), name
+            )
+            for name in by
+        )
+    )
+
+
+def sales(conn, year, by, version):
+    """Quantity and value sold of every SKU in ``year``, in total and per
+    value of each dimension in ``by``."""
+
+    def compute():
+        query = sql.SQL(
+            """
+            SELECT sku, {rollup} AS rollup, {dimensions},
+                   sum(qty) AS qty, sum(total_price) AS total
+            FROM product_sales
+            WHERE year = %(year)s
+            GROUP BY sku, GROUPING SETS ((), {sets})
+            ORDER BY sku, rollup, {dimensions_order};
+            """
+        ).format(
+            rollup=_rollup(SALES, by),
+            dimensions=sql.SQL(", ").join(
+                sql.SQL("{} AS {}").format(sql.Identifier(SALES[name]), sql.Identifier(name))
+                for name in by
+            ),
+            sets=sql.SQL(", ").join(
+                sql.SQL("({})").format(sql.Identifier(SALES[name])) for name in by
+            ),
+            dimensions_order=sql.SQL(", ").join(
+                SALES_ORDER.get(name, sql.Identifier(SALES[name])) for name in by
+            ),
+        )
+        with conn.cursor(row_factory=dict_row) as cur:
+            return cur.execute(query, {"year": year}).fetchall()
+
+    return _cached(("sales", version), compute)
+
+
+def daily_average(conn, year, by, version):
+    """Average value sold per day of ``year``, in total and per value of each
+    dimension in ``by``. Days without sales count as zero."""
+
+    def compute():
+        query = sql.SQL(
+            """
+            WITH daily AS (
+                SELECT d.date, d.month, d.weekday, d.weekday_order,
+                       coalesce(sum(s.total_price), 0) AS total
+                FROM calendar d
+                LEFT JOIN product_sales s ON s.date = d.date AND s.year = %(year)s
+                WHERE d.year = %(year)s
+                GROUP BY d.date
+            )
+            SELECT {rollup} AS rollup, {dimensions},
+                   round(avg(total), 2) AS average, count(*) AS days
+            FROM daily
+            GROUP BY GROUPING SETS ((), {sets})
+            ORDER BY rollup, {dimensions_order};
+            """
+        ).format(
+            rollup=_rollup(DAILY, by),
+            dimensions=sql.SQL(", ").join(
+                sql.SQL("{} AS {}").format(sql.Identifier(DAILY[name]), sql.Identifier(name))
+                for name in by
+            ),
+            sets=sql.SQL(", ").join(
+                sql.SQL("({})").format(sql.Identifier(DAILY[name])) for name in by
+            ),
+            dimensions_order=sql.SQL(", ").join(
+                DAILY_ORDER.get(name, sql.Identifier(DAILY[name])) for name in by
+            ),
+        )
+        with conn.cursor(row_factory=dict_row) as cur:
+            return cur.execute(query, {"year": year}).fetchall()
+
+    return _cached(("daily_average", version), compute)
@@ -2,23 +2,44 @@
 from logging.config import dictConfig
 
 import math
+import accounts
+import analytics
 import aux
+import bulk
+import carts
+import catalog
+import counts
+import dbpool
+import etags
+import export
+import ids
+import metrics
+import pagination
+import payments
+import querylog
+import search
+import time
 import psycopg
 from flask import session
 from flask import flash
 from flask import Flask
+from flask import Response
+from flask import abort
+from flask import g
 from flask import jsonify
+from flask import make_response
 from flask import redirect
 from flask import render_template
 from flask import request
 from flask import url_for
+from psycopg import sql
 from psycopg.rows import namedtuple_row
-from psycopg_pool import ConnectionPool
 
-# postgres://{user}:{password}@{hostname}:{port}/{database-name}
-DATABASE_URL = "postgres://db:db@postgres/db"
+DATABASE_URL = dbpool.DATABASE_URL
 
-pool = ConnectionPool(conninfo=DATABASE_URL)
+pool = dbpool.TimedConnectionPool(
+    **dbpool.settings(), kwargs={"cursor_factory": metrics.TimedCursor}
+)
 # the pool starts connecting immediately.
 
 
@@ -48,48 +69,128 @@ app.config.update(
 )
 log = app.logger
 
+dbpool.warm_up(pool, log)
+
+
+# Most statements each route may run. With QUERY_LOG set, requests that go
+# over budget or repeat a statement are logged, and fail outright when
+# QUERY_BUDGET_STRICT is configured (e.g. in tests).
+QUERY_BUDGETS = {
+    "customer_index": 4,
+    "customer_add": 2,
+    "customer_profile": 4,
+    "order_status": 3,
+    "make_order": 5,
+    "supplier_edit": 3,
+    "supplier_add": 2,
+    "product_index": 4,
+    "product_add": 2,
+    "product_edit": 3,
+    "confirm_delete_c": 1,
+    "customer_delete": 1,
+    "confirm_delete_p": 1,
+    "product_delete": 1,
+    "bulk_import": 6,
+    "pay_orders": 1,
+    "analytics_sales": 2,
+    "analytics_daily_average": 2,
+}
+app.config.setdefault("QUERY_BUDGET_STRICT", False)
+
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    if querylog.ENABLED:
+        g.querylog = querylog.QueryLog()
+
+
+@app.after_request
+def record_timing(response):
+    started = g.pop("started", None)
+    if started is not None:
+        metrics.request_duration.observe(
+            time.perf_counter() - started,
+            metrics.route(),
+            request.method,
+            str(response.status_code),
+        )
+    if "querylog" in g:
+        response.headers["X-Query-Count"] = str(len(g.querylog.statements))
+        response.headers["X-Pool-Checkouts"] = str(g.querylog.checkouts)
+        try:
+            g.querylog.check(QUERY_BUDGETS.get(request.endpoint))
+        except querylog.QueryBudgetExceeded as e:
+            log.warning(f"{request.endpoint}: {e}")
+            if app.config["QUERY_BUDGET_STRICT"]:
+                raise
+    return response
+
+
+@app.teardown_request
+def record_failure(exc):
+    # Requests that raised never got to record_timing().
+    started = g.pop("started", None)
+    if started is not None:
+        metrics.request_duration.observe(
+            time.perf_counter() - started, metrics.route(), request.method, "500"
+        )
+
+
+# How many dependent rows the delete confirmation pages list by number.
+DEPENDENCY_SAMPLE = 10
+
 
 @app.route("/", methods=("GET",))
 @app.route("/customers", methods=("GET",))
 def customer_index():
     """Show all the accounts, most recent first."""
 
+    # API-like response is returned to clients that request JSON explicitly (e.g., fetch)
+    wants_json = (
+        request.accept_mimetypes["application/json"]
+        and not request.accept_mimetypes["text/html"]
+    )
+
     page = int(request.args.get('page', 1))
     per_page = 5
-    offset = (page - 1) * per_page
     with pool.connection() as conn:
+        # Pollers of an unchanged page get a 304 before the page is read.
+        # The count comes from the same row as the version, so a tag never
+        # goes with a page count older than it.
+        if wants_json:
+            customers_all, version = counts.versioned(conn, "customer")
+            etag = etags.make(version, request.full_path)
+            if request.if_none_match.contains(etag):
+                return etags.not_modified(etag, vary="Accept")
+        else:
+            customers_all = counts.count(conn, "customer")
+
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            customers = cur.execute(
-                """
-                SELECT cust_no, name, email, phone
-                FROM customer
-                ORDER BY cust_no
-                LIMIT %(per_page)s OFFSET %(offset)s;
-                """,
-                {"per_page":per_page,"offset":offset},
-            ).fetchall()
-            log.debug(f"Found {cur.rowcount} rows.")
-        
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            customers_all = cur.execute(
-                """
-                SELECT count(*) as total
-                FROM customer;
-                """,
-                {},
-            ).fetchone().total
-            log.debug(f"Found {cur.rowcount} rows.")
+            page = pagination.fetch_page(
+                cur,
+                "customer",
+                ("cust_no", "name", "email", "phone"),
+                ("cust_no",),
+                after=request.args.get("after"),
+                page=page,
+                per_page=per_page,
+            )
+            customers = page.rows
+            log.debug(f"Found {len(customers)} rows.")
+        log.debug(f"Found {customers_all} rows.")
 
     total_pages = math.ceil(customers_all / per_page)
 
-    # API-like response is returned to clients that request JSON explicitly (e.g., fetch)
-    if (
-        request.accept_mimetypes["application/json"]
-        and not request.accept_mimetypes["text/html"]
-    ):
-        return jsonify(customers,page,total_pages)
+    if wants_json:
+        response = jsonify(customers,page.number,total_pages)
+        response.headers["Link"] = pagination.link_header(page, "customer_index")
+        response.vary.add("Accept")
+        return etags.tag(response, etag)
 
-    return render_template("account/index.html", customers=customers,page=page, total_pages=total_pages)
+    response = make_response(render_template("account/index.html", customers=customers,page=page, total_pages=total_pages))
+    response.vary.add("Accept")
+    return response
 
 
 @app.route("/customers/register",methods= ("GET","POST"))
@@ -123,33 +224,25 @@ def customer_add():
             flash(error)
         else:
             with pool.connection() as conn:
-                with conn.cursor(row_factory=namedtuple_row) as cur:
-                    customer = cur.execute(
-                        """
-                        SELECT max(cust_no) as last
-                        FROM customer;
-                        """,
-                        {},
-                    ).fetchone()
-                    log.debug(f"Found {cur.rowcount} rows.")
-                    log.debug(f"Found {customer[0]} rows.")
-
-                cust_no = int(customer[0]) +1
-                cust_no = str(cust_no)
+                cust_no = ids.reserve(conn, "customer", "cust_no")
 
                 try:
                     with conn.cursor(row_factory=namedtuple_row) as cur:
-                        cur.execute(
+                        cust_no = cur.execute(
                             """
-                            INSERT INTO customer VALUES (%(cust_no)s, %(name)s, %(email)s, %(phone)s, %(address)s);
+                            INSERT INTO customer
+                            VALUES (coalesce(%(cust_no)s, nextval(pg_get_serial_sequence('customer', 'cust_no'))),
+                                    %(name)s, %(email)s, %(phone)s, %(address)s)
+                            RETURNING cust_no;
                             """,
                             {"cust_no": cust_no, "name": name, "email": email, "phone": phone, "address": address},
-                        )
-                        log.debug(f"Inserted {cur.rowcount} rows.")
+                        ).fetchone().cust_no
+                        log.debug(f"Inserted customer {cust_no}.")
                 except Exception as e:
                     error = "An error occurred while inserting the customer: " + str(e)
                     flash(error)
 
+            counts.invalidate("customer")
             return redirect(url_for("customer_index"))
 
     return render_template("account/add_customer.html")
@@ -157,171 +250,141 @@ def customer_add():
 @app.route("/customers/<cust_no>/profile", methods=("GET",))
 def customer_profile(cust_no):
 
+    # API-like response is returned to clients that request JSON explicitly (e.g., fetch)
+    wants_json = accounts.wants_json(request)
+
     with pool.connection() as conn:
+        # An unchanged page gets a 304 before it is read; pages carrying
+        # flashed messages never do.
+        etag = None
+        if "_flashes" not in session:
+            etag = etags.query(
+                conn, etags.PROFILE_VERSION, {"cust_no": cust_no}, request.full_path, wants_json
+            )
+            if request.if_none_match.contains(etag):
+                return etags.not_modified(etag, vary="Accept")
 
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            customer_orders = cur.execute(
-                """
-                SELECT order_no FROM orders WHERE cust_no = %(cust_no)s;
-                """,
-                {"cust_no":cust_no},
-            ).fetchall()
-            log.debug(f"Found {cur.rowcount} rows.")
+            customer_info = cur.execute(accounts.CUSTOMER, {"cust_no":cust_no}).fetchone()
 
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            customer_info = cur.execute(
-                """
-                SELECT * FROM customer WHERE cust_no = %(cust_no)s;
-                """,
-                {"cust_no":cust_no},
-            ).fetchone()
+        if customer_info is None:
+            abort(404)
 
+        with conn.cursor(row_factory=namedtuple_row) as cur:
+            page = pagination.fetch_page(cur, **accounts.history(cust_no, request.args))
+            log.debug(f"Found {len(page.rows)} rows.")
 
-    return render_template("account/profile.html", customer_orders=customer_orders,customer_info=customer_info)
+    if wants_json:
+        response = jsonify(accounts.profile(customer_info, page))
+        response.headers["Link"] = pagination.link_header(page, "customer_profile", cust_no=cust_no)
+    else:
+        response = make_response(render_template(accounts.PROFILE_TEMPLATE, **accounts.profile_page(customer_info, page)))
+    response.vary.add("Accept")
+    return etags.tag(response, etag) if etag else response
 
 @app.route("/customers/<cust_no>/<order_no>", methods=("GET","POST"))
 def order_status(cust_no, order_no):
 
+    if request.method == "POST":
+        try:
+            pair = (payments.number(cust_no), payments.number(order_no))
+        except (TypeError, ValueError):
+            abort(404)
+        # One statement on one connection; paying again is a no-op.
+        with pool.connection() as conn:
+            result = payments.pay(conn, [pair])
+        log.debug(f"Payment of order {order_no}: {result}.")
+        if result["unknown"]:
+            abort(404)
+        if result["already_paid"]:
+            flash("The order was already paid.")
+        return redirect(url_for("order_status", order_no=order_no, cust_no=cust_no))
+
+    etag = None
     with pool.connection() as conn:
+        # Pages carrying flashed messages are never answered with a 304.
+        if "_flashes" not in session:
+            etag = etags.query(conn, etags.ORDER_VERSION, {"order_no":order_no, "cust_no":cust_no})
+            if request.if_none_match.contains(etag):
+                return etags.not_modified(etag)
+
         with conn.cursor(row_factory=namedtuple_row) as cur:
             log.debug(f"Found {order_no} ,{cust_no}rows.")
-            contains= cur.execute(
-                """
-                SELECT p.name, p.sku, c.qty, c.qty*p.price as total_p 
-                FROM contains c
-                JOIN product p USING (sku)
-                WHERE order_no = %(order_no)s;
-                """,
-                {"order_no":order_no },
-            ).fetchall()
+            contains= cur.execute(accounts.ORDER_LINES, {"order_no":order_no }).fetchall()
 
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            paid=cur.execute(
-                """
-                SELECT cust_no, order_no
-                FROM pay
-                WHERE order_no = %(order_no)s
-                AND cust_no = %(cust_no)s;
-                """,
-                {"order_no": order_no, "cust_no": cust_no},
+            order=cur.execute(
+                accounts.ORDER_TOTAL, {"order_no": order_no, "cust_no": cust_no}
             ).fetchone()
-        
-        if request.method == "POST":
 
-            with pool.connection() as conn:
-                with conn.cursor(row_factory=namedtuple_row) as cur:
-                    
-                    contains= cur.execute(
-                        """
-                        INSERT INTO pay VALUES (%(order_no)s,%(cust_no)s);
-                        """,
-                        {"order_no":order_no,"cust_no":cust_no },
-                    )
-
-                return redirect(url_for("order_status", order_no=order_no, cust_no=cust_no))
-
-        if paid is not None:
-            paid = True
-        else:
-            paid = False
-
-
-    return render_template("account/order.html", contains=contains, paid=paid, order_no=order_no, cust_no=cust_no )
+    response = make_response(render_template(accounts.ORDER_TEMPLATE, **accounts.order_page(cust_no, order_no, contains, order)))
+    return etags.tag(response, etag) if etag else response
 
 @app.route("/customers/<cust_no>/make_order", methods=("GET","POST"))
 def make_order(cust_no):
     
     log.debug(f"Found {request.form} rows.")
-    if "cart" not in request.args:
-        session.clear()
 
-    cart = session.get('cart', {})
+    if request.method == "POST" and "checkout" in request.form:
+        # The order and all of its lines go in one statement, straight from
+        # the cart, so the number of round trips does not grow with its size.
+        # An empty cart is turned away first, so it uses up no order number.
+        try:
+            with pool.connection() as conn:
+                with conn.transaction():
+                    order_no = None
+                    if not carts.is_empty(conn, cust_no):
+                        order_no = carts.checkout(
+                            conn, cust_no, ids.reserve(conn, "orders", "order_no")
+                        )
+        except Exception as e:
+            flash("An error occurred while placing the order: " + str(e))
+            return redirect(url_for("make_order", cust_no=cust_no))
+
+        if order_no is None:
+            flash("The cart is empty.")
+            return redirect(url_for("make_order", cust_no=cust_no))
+
+        log.debug(f"Placed order {order_no}.")
+        flash("Order placed successfully!")
+        return redirect(url_for("customer_profile",cust_no=cust_no))
 
     page = int(request.args.get('page', 1))
     per_page = 4
-    offset = (page - 1) * per_page
+    q = request.args.get("q", "").strip()
 
     with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            products = cur.execute(
-                """
-                SELECT sku,name, description, price
-                FROM product
-                ORDER BY price
-                LIMIT %(per_page)s OFFSET %(offset)s;
-                """,
-                {"per_page":per_page,"offset":offset},
-            ).fetchall()
-            log.debug(f"Found {cur.rowcount} rows.")
-
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            all_products = cur.execute(
-                """
-                SELECT count(*) as total
-                FROM product;
-                """,
-                {},
-            ).fetchone().total
-            log.debug(f"Found {cur.rowcount} rows.")
-
-    total_pages = math.ceil(all_products / per_page)
-
-    if request.method == "POST":
-    
-        if "add" in request.form:
-            sku = str(request.form["add"])
-            qty = int(request.form[sku])
-            cart[sku]=qty
-            session['cart'] = cart
-            log.debug(f"Found {cur.rowcount} rows.")
-
-        elif "checkout" in request.form:
-            
-            with conn.cursor(row_factory=namedtuple_row) as cur:
-                    order = cur.execute(
-                        """
-                        SELECT max(order_no) as last
-                        FROM orders;
-                        """,
-                        {},
-                    ).fetchone()
-
-            order_no = int(order[0]) +1
-
-
-            with conn.cursor(row_factory=namedtuple_row) as cur:
-
-                cur.execute(
-                    """
-                    BEGIN;
-                    """,
-                    {},
-                )
-
-                cur.execute(
-                    """
-                    INSERT INTO orders VALUES(%(order_no)s,%(cust_no)s,current_date);
-                    """,
-                    {"cust_no":cust_no,"order_no":order_no},
-                )
+        if request.method == "POST":
+            try:
+                if "add" in request.form:
+                    sku = str(request.form["add"])
+                    qty = int(request.form[sku])
+                    carts.update(conn, cust_no, sku, qty)
+                    log.debug(f"Set {sku} to {qty} in the cart.")
+                elif "remove" in request.form:
+                    carts.remove(conn, cust_no, request.form["remove"])
+            except (ValueError, psycopg.Error) as e:
+                conn.rollback()
+                flash("An error occurred while updating the cart: " + str(e))
+
+        cart = carts.get(conn, cust_no)
+        log.debug(f"Found {len(cart.lines)} rows.")
+
+        if q:
+            page = search.page(conn, q, request.args.get("after"), page, per_page)
+            total_pages = None
+        else:
+            # The count and the version of the catalog in one statement.
+            all_products, version = counts.versioned(conn, "product")
+            page = catalog.page(
+                conn, request.args.get("after"), page, per_page, version=version
+            )
+            log.debug(f"Found {all_products} rows.")
+            total_pages = math.ceil(all_products / per_page)
+        products = page.rows
+        log.debug(f"Found {len(products)} rows.")
 
-                for key in cart:
-                    cur.execute(
-                    """
-                    INSERT INTO contains VALUES(%(order_no)s,%(sku)s,%(qty)s);
-                    """,
-                    {"order_no":order_no,"sku":key,"qty":cart[key]},
-                )
-                cur.execute(
-                    """
-                    COMMIT;
-                    """,
-                )
-            session.clear()
-            flash("Order placed successfully!")
-            return redirect(url_for("customer_profile",cust_no=cust_no))
-        
-    return render_template("account/make_order.html", products=products,page=page, total_pages=total_pages,cust_no=cust_no,cart=cart)
+    return render_template("account/make_order.html", products=products,page=page, total_pages=total_pages,cust_no=cust_no,cart=cart,q=q)
 
 @app.route("/products/<sku>/edit_supplier",methods=("GET","POST"))
 def supplier_edit(sku):
@@ -355,6 +418,7 @@ def supplier_edit(sku):
                         error = "An error occurred while inserting the product: " + str(e)
                         flash(error)
 
+            counts.invalidate("supplier")
             return redirect(url_for("supplier_edit",sku=sku))
         
         elif 'confirmation' in request.form:
@@ -387,36 +451,30 @@ def supplier_edit(sku):
                         error = "An error occurred while inserting the product: " + str(e)
                         flash(error)
 
+            counts.invalidate("supplier")
             return redirect(url_for("supplier_edit",sku=sku))
     
 
     page = int(request.args.get('page', 1))
     per_page = 5
-    offset = (page - 1) * per_page
 
     with pool.connection() as conn:
             with conn.cursor(row_factory=namedtuple_row) as cur:
-                suppliers = cur.execute(
-                    """
-                    SELECT tin ,name, address, date
-                    FROM supplier
-                    WHERE sku = %(sku)s
-                    ORDER BY date
-                    LIMIT %(per_page)s OFFSET %(offset)s;
-                    """,
-                    {"per_page":per_page,"offset":offset,"sku":sku},
-                ).fetchall()
-                log.debug(f"Found {cur.rowcount} rows.")
+                page = pagination.fetch_page(
+                    cur,
+                    "supplier",
+                    ("tin", "name", "address", "date"),
+                    ("date", "tin"),
+                    after=request.args.get("after"),
+                    page=page,
+                    per_page=per_page,
+                    where=sql.SQL("sku = %(sku)s"),
+                    params={"sku":sku},
+                )
+                suppliers = page.rows
+                log.debug(f"Found {len(suppliers)} rows.")
 
-            with conn.cursor(row_factory=namedtuple_row) as cur:
-                all_suppliers = cur.execute(
-                """
-                SELECT count(*) as total
-                FROM supplier
-                WHERE sku = %(sku)s;
-                """,
-                {"sku":sku},
-            ).fetchone().total
+            all_suppliers = counts.count(conn, "supplier", sku)
             log.debug(f"Found {all_suppliers} rows.")
 
     total_pages = math.ceil(all_suppliers / per_page)
@@ -471,6 +529,7 @@ def supplier_add(sku):
                             """,
                             {"sku":sku,"tin":tin,"name":name,"address":address},
                         )
+        counts.invalidate("supplier", sku)
         return redirect(url_for("supplier_edit",sku=sku))
     return render_template("product/add_supplier.html", sku=sku)
 
@@ -485,44 +544,50 @@ def supplier_add(sku):
 def product_index():
     """Show all the accounts, most recent first."""
 
-    page = int(request.args.get('page', 1))
-    per_page = 5
-    offset = (page - 1) * per_page
-
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            products = cur.execute(
-                """
-                SELECT sku,name, description, price
-                FROM product
-                ORDER BY price
-                LIMIT %(per_page)s OFFSET %(offset)s;
-                """,
-                {"per_page":per_page,"offset":offset},
-            ).fetchall()
-            log.debug(f"Found {cur.rowcount} rows.")
-
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            all_products = cur.execute(
-                """
-                SELECT count(*) as total
-                FROM product;
-                """,
-                {},
-            ).fetchone().total
-            log.debug(f"Found {cur.rowcount} rows.")
-
-    total_pages = math.ceil(all_products / per_page)
-
     # API-like response is returned to clients that request JSON explicitly (e.g., fetch)
-    if (
+    wants_json = (
         request.accept_mimetypes["application/json"]
         and not request.accept_mimetypes["text/html"]
-    ):
-        return jsonify(products)
+    )
 
+    page = int(request.args.get('page', 1))
+    per_page = 5
+    q = request.args.get("q", "").strip()
 
-    return render_template("product/product.html", products=products,page=page, total_pages=total_pages)
+    with pool.connection() as conn:
+        # Pollers of an unchanged page get a 304 before the page is read. The
+        # cached page is looked up by the same version, and the count comes
+        # from the same row, so a tag is never given to an older page.
+        all_products, version = counts.versioned(conn, "product")
+        if wants_json:
+            etag = etags.make(version, request.full_path)
+            if request.if_none_match.contains(etag):
+                return etags.not_modified(etag, vary="Accept")
+
+        if q:
+            # Matches are not counted; the pages end where the results do.
+            page = search.page(conn, q, request.args.get("after"), page, per_page)
+            total_pages = None
+        else:
+            page = catalog.page(
+                conn, request.args.get("after"), page, per_page, version=version
+            )
+            log.debug(f"Found {all_products} rows.")
+            total_pages = math.ceil(all_products / per_page)
+        products = page.rows
+        log.debug(f"Found {len(products)} rows.")
+
+    if wants_json:
+        response = jsonify(products)
+        response.headers["Link"] = pagination.link_header(
+            page, "product_index", **({"q": q} if q else {})
+        )
+        response.vary.add("Accept")
+        return etags.tag(response, etag)
+
+    response = make_response(render_template("product/product.html", products=products,page=page, total_pages=total_pages, q=q))
+    response.vary.add("Accept")
+    return response
 
 @app.route("/product/register",methods=("GET","POST"))
 def product_add():
@@ -582,6 +647,7 @@ def product_add():
                     error = "An error occurred while inserting the product: " + str(e)
                     flash(error)
 
+            counts.invalidate("product")
             return redirect(url_for("product_index"))
 
     return render_template("product/add_product.html")
@@ -590,13 +656,7 @@ def product_add():
 def product_edit(sku):
 
     with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            product = cur.execute(
-                """
-                SELECT * FROM product WHERE sku = %(sku)s;
-                """,
-                {"sku":sku},
-            ).fetchone()
+        product = catalog.product(conn, sku)
     
     if request.method =="POST":
 
@@ -689,69 +749,55 @@ def customer_update(cust_no):
 
 @app.route("/customers/<int:cust_no>/confirm_delete", methods=["GET"])
 def confirm_delete_c(cust_no):
+    """Show what deleting the customer would take with it."""
+
+    # One round trip: the counts of dependent rows plus a short sample of each.
     with pool.connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            # Retrieve customer information
             customer_info = cur.execute(
                 """
-                SELECT * FROM customer WHERE cust_no = %(cust_no)s;
+                SELECT c.cust_no, c.name, c.email, c.phone, c.address,
+                    (SELECT count(*) FROM orders o WHERE o.cust_no = c.cust_no) AS order_count,
+                    ARRAY(
+                        SELECT o.order_no FROM orders o
+                        WHERE o.cust_no = c.cust_no
+                        ORDER BY o.order_no LIMIT %(sample)s
+                    ) AS orders,
+                    (SELECT count(*) FROM pay p WHERE p.cust_no = c.cust_no) AS pay_count,
+                    ARRAY(
+                        SELECT p.order_no FROM pay p
+                        WHERE p.cust_no = c.cust_no
+                        ORDER BY p.order_no LIMIT %(sample)s
+                    ) AS pay,
+                    (
+                        SELECT count(*) FROM process pr
+                        JOIN orders o USING (order_no)
+                        WHERE o.cust_no = c.cust_no
+                    ) AS process_count,
+                    ARRAY(
+                        SELECT pr.order_no FROM process pr
+                        JOIN orders o USING (order_no)
+                        WHERE o.cust_no = c.cust_no
+                        ORDER BY pr.order_no LIMIT %(sample)s
+                    ) AS process,
+                    (
+                        SELECT count(*) FROM contains co
+                        JOIN orders o USING (order_no)
+                        WHERE o.cust_no = c.cust_no
+                    ) AS contains_count,
+                    ARRAY(
+                        SELECT co.order_no FROM contains co
+                        JOIN orders o USING (order_no)
+                        WHERE o.cust_no = c.cust_no
+                        ORDER BY co.order_no LIMIT %(sample)s
+                    ) AS contains
+                FROM customer c
+                WHERE c.cust_no = %(cust_no)s;
                 """,
-                {"cust_no": cust_no},
+                {"cust_no": cust_no, "sample": DEPENDENCY_SAMPLE},
             ).fetchone()
 
-            order_info= cur.execute(
-                """
-                SELECT order_no
-                FROM orders
-                WHERE cust_no = %(cust_no)s;
-                """,
-                {"cust_no": cust_no}
-            ).fetchall()            
-            # Retrieve order numbers associated with the customer
-            cur.execute(
-                """
-                SELECT order_no
-                FROM orders
-                WHERE cust_no = %(cust_no)s;
-                """,
-                {"cust_no": cust_no}
-            )
-            order_nos = [row.order_no for row in cur.fetchall()]
-
-            # Retrieve pay, process, and contains information
-            pay = []
-            process = []
-            contains = []
-
-            for order_no in order_nos:
-                pay_result = cur.execute(
-                    """
-                    SELECT cust_no FROM pay
-                    WHERE cust_no = %(cust_no)s;
-                    """,
-                    {"cust_no": cust_no},
-                ).fetchall()
-                pay.extend(pay_result)
-
-                process_result = cur.execute(
-                    """
-                    SELECT order_no FROM process
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
-                ).fetchall()
-                process.extend(process_result)
-
-                contains_result = cur.execute(
-                    """
-                    SELECT order_no FROM contains
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
-                ).fetchall()
-                contains.extend(contains_result)
-
-    return render_template("account/confirm_delete.html", customer_info=customer_info, order_info=order_info, pay=pay, process=process, contains=contains)
+    return render_template("account/confirm_delete.html", customer_info=customer_info)
 
 
 
@@ -759,260 +805,254 @@ def confirm_delete_c(cust_no):
 def customer_delete(cust_no):
     """Delete the customer from multiple tables."""
 
+    # Everything hanging off the customer goes in one statement, however
+    # many orders it has.
     with pool.connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            # Retrieve all order_no values associated with the customer
             cur.execute(
                 """
-                SELECT order_no
-                FROM orders
-                WHERE cust_no = %(cust_no)s;
-                """,
-                {"cust_no": cust_no}
-            )
-            order_nos = [row.order_no for row in cur.fetchall()]
-
-            for order_no in order_nos:
-                # Delete rows associated with each order_no
-                cur.execute(
-                    """
+                WITH doomed AS (
+                    SELECT order_no FROM orders WHERE cust_no = %(cust_no)s
+                ),
+                paid AS (
                     DELETE FROM pay
-                    WHERE cust_no = %(cust_no)s;
-                    """,
-                    {"cust_no": cust_no},
-                )
-                cur.execute(
-                    """
-                    DELETE FROM process
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
+                    WHERE cust_no = %(cust_no)s
+                    OR order_no IN (SELECT order_no FROM doomed)
+                ),
+                processed AS (
+                    DELETE FROM process WHERE order_no IN (SELECT order_no FROM doomed)
+                ),
+                lines AS (
+                    DELETE FROM contains WHERE order_no IN (SELECT order_no FROM doomed)
+                ),
+                placed AS (
+                    DELETE FROM orders WHERE cust_no = %(cust_no)s
                 )
-                cur.execute(
-                    """
-                    DELETE FROM contains
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
-                )
-
-                # Delete the order itself
-                cur.execute(
-                    """
-                    DELETE FROM orders
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
-                )
-
-            # Delete the customer
-            cur.execute(
-                """
                 DELETE FROM customer
                 WHERE cust_no = %(cust_no)s;
                 """,
                 {"cust_no": cust_no},
             )
+            log.debug(f"Deleted {cur.rowcount} rows.")
 
-            conn.commit()
-
+    counts.invalidate("customer")
     return redirect(url_for("customer_index"))
 
 
 @app.route("/products/<sku>/confirm_delete", methods=["GET"])
 def confirm_delete_p(sku):
-    """Delete the product."""
+    """Show what deleting the product would take with it."""
 
+    # One round trip: the counts of dependent rows plus a short sample of each.
     with pool.connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                SELECT order_no
-                FROM contains
-                WHERE sku = %(sku)s;
-                """,
-                {"sku": sku}
-            )
-            order_nos = [row.order_no for row in cur.fetchall()]
-            
-            cur.execute(
-                """
-                SELECT tin
-                FROM supplier
-                WHERE sku = %(sku)s;
-                """,
-                {"sku": sku}
-            )
-            TINs = [row.tin for row in cur.fetchall()]
-
-            pay = []
-            process = []
-            contains = []
-
-            for order_no in order_nos:
-                # Delete rows associated with each order_no
-                pay_results=cur.execute(
-                    """
-                    SELECT order_no FROM pay
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
-                ).fetchall()
-                pay.extend(pay_results)
-
-                process_result=cur.execute(
-                    """
-                    SELECT order_no FROM process
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
-                ).fetchall()
-                process.extend(process_result)
-
-                contains_results=cur.execute(
-                    """
-                    SELECT order_no FROM contains
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
-                ).fetchall()
-                contains.extend(contains_results)
-
-                # Delete the order itself
-                order_info=cur.execute(
-                    """
-                    SELECT order_no FROM orders
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
-                ).fetchall()
-            
-            delivery = []
-
-            for TIN in TINs:
-                # Delete rows associated with each TIN
-                delivery_results=cur.execute(
-                    """
-                    SELECT tin FROM delivery
-                    WHERE tin = %(tin)s;
-                    """,
-                    {"tin": TIN},
-                ).fetchall()
-                delivery.extend(delivery_results)
-                
-            supplier=cur.execute(
-                """
-                SELECT sku FROM supplier
-                WHERE sku = %(sku)s;
-                """,
-                {"sku": sku},
-            ).fetchall()
-            
-            product=cur.execute(
+            product = cur.execute(
                 """
-                SELECT * FROM product
-                WHERE sku = %(sku)s;
+                WITH doomed AS (
+                    SELECT order_no FROM contains WHERE sku = %(sku)s
+                ),
+                tins AS (
+                    SELECT tin FROM supplier WHERE sku = %(sku)s
+                )
+                SELECT p.sku, p.name, p.description, p.price, p.ean,
+                    (SELECT count(*) FROM doomed) AS order_count,
+                    ARRAY(
+                        SELECT order_no FROM doomed
+                        ORDER BY order_no LIMIT %(sample)s
+                    ) AS orders,
+                    (SELECT count(*) FROM pay WHERE order_no IN (SELECT order_no FROM doomed)) AS pay_count,
+                    ARRAY(
+                        SELECT order_no FROM pay
+                        WHERE order_no IN (SELECT order_no FROM doomed)
+                        ORDER BY order_no LIMIT %(sample)s
+                    ) AS pay,
+                    (SELECT count(*) FROM process WHERE order_no IN (SELECT order_no FROM doomed)) AS process_count,
+                    ARRAY(
+                        SELECT order_no FROM process
+                        WHERE order_no IN (SELECT order_no FROM doomed)
+                        ORDER BY order_no LIMIT %(sample)s
+                    ) AS process,
+                    (SELECT count(*) FROM contains WHERE order_no IN (SELECT order_no FROM doomed)) AS contains_count,
+                    ARRAY(
+                        SELECT order_no FROM contains
+                        WHERE order_no IN (SELECT order_no FROM doomed)
+                        ORDER BY order_no LIMIT %(sample)s
+                    ) AS contains,
+                    (SELECT count(*) FROM tins) AS supplier_count,
+                    ARRAY(SELECT tin FROM tins ORDER BY tin LIMIT %(sample)s) AS supplier,
+                    (SELECT count(*) FROM delivery WHERE tin IN (SELECT tin FROM tins)) AS delivery_count,
+                    ARRAY(
+                        SELECT tin FROM delivery
+                        WHERE tin IN (SELECT tin FROM tins)
+                        ORDER BY tin LIMIT %(sample)s
+                    ) AS delivery
+                FROM product p
+                WHERE p.sku = %(sku)s;
                 """,
-                {"sku": sku},
+                {"sku": sku, "sample": DEPENDENCY_SAMPLE},
             ).fetchone()
-            
-            
-    return render_template("product/confirm_delete.html", product=product, order_info=order_info, supplier=supplier, pay=pay, process=process, contains=contains, delivery=delivery)
+
+    return render_template("product/confirm_delete.html", product=product)
+
 
 @app.route("/product/<sku>/delete", methods=("POST",))
 def product_delete(sku):
     """Delete the product."""
 
+    # Orders containing the product are removed whole, as are the
+    # suppliers of the product, all in one statement.
     with pool.connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute(
                 """
-                SELECT order_no
-                FROM contains
-                WHERE sku = %(sku)s;
-                """,
-                {"sku": sku}
-            )
-            order_nos = [row.order_no for row in cur.fetchall()]
-            
-            cur.execute(
-                """
-                SELECT tin
-                FROM supplier
-                WHERE sku = %(sku)s;
-                """,
-                {"sku": sku}
-            )
-            TINs = [row.tin for row in cur.fetchall()]
-            
-            for order_no in order_nos:
-                # Delete rows associated with each order_no
-                cur.execute(
-                    """
-                    DELETE FROM pay
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
-                )
-                cur.execute(
-                    """
-                    DELETE FROM process
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
-                )
-                cur.execute(
-                    """
-                    DELETE FROM contains
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
-                )
-
-                # Delete the order itself
-                cur.execute(
-                    """
-                    DELETE FROM orders
-                    WHERE order_no = %(order_no)s;
-                    """,
-                    {"order_no": order_no},
-                )
-                
-            for TIN in TINs:
-                # Delete rows associated with each TIN
-                cur.execute(
-                    """
+                WITH doomed AS (
+                    SELECT order_no FROM contains WHERE sku = %(sku)s
+                ),
+                paid AS (
+                    DELETE FROM pay WHERE order_no IN (SELECT order_no FROM doomed)
+                ),
+                processed AS (
+                    DELETE FROM process WHERE order_no IN (SELECT order_no FROM doomed)
+                ),
+                lines AS (
+                    DELETE FROM contains WHERE order_no IN (SELECT order_no FROM doomed)
+                ),
+                placed AS (
+                    DELETE FROM orders WHERE order_no IN (SELECT order_no FROM doomed)
+                ),
+                delivered AS (
                     DELETE FROM delivery
-                    WHERE tin = %(tin)s;
-                    """,
-                    {"tin": TIN},
+                    WHERE tin IN (SELECT tin FROM supplier WHERE sku = %(sku)s)
+                ),
+                supplied AS (
+                    DELETE FROM supplier WHERE sku = %(sku)s
                 )
-                
-            cur.execute(
-                """
-                DELETE FROM supplier
-                WHERE sku = %(sku)s;
-                """,
-                {"sku": sku},
-            )
-            
-            cur.execute(
-                """
                 DELETE FROM product
                 WHERE sku = %(sku)s;
                 """,
                 {"sku": sku},
             )
-            
-            
-        conn.commit()
+            log.debug(f"Deleted {cur.rowcount} rows.")
+
+    counts.invalidate("product")
+    counts.invalidate("supplier", sku)
     return redirect(url_for("product_index"))
 
+@app.route("/import/<kind>", methods=("POST",))
+def bulk_import(kind):
+    """Import a CSV of customers, products or suppliers, sent as the request
+    body or as the "file" field of a form."""
+
+    if kind not in bulk.KINDS:
+        abort(404)
+    source = request.files["file"].stream if "file" in request.files else request.stream
+
+    try:
+        with pool.connection() as conn:
+            result = bulk.load(conn, kind, source)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    counts.invalidate(bulk.KINDS[kind]["table"])
+    log.debug(f"Imported {kind}: {result['inserted']} inserted, {result['updated']} updated.")
+    return jsonify(result)
+
+
+@app.route("/payments", methods=("POST",))
+def pay_orders():
+    """Pay many orders at once. The JSON body lists them as
+    {"orders": [{"cust_no": ..., "order_no": ...}, ...]}; the answer lists
+    the order numbers paid now, already paid before, and unknown."""
+
+    try:
+        pairs = payments.parse(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with pool.connection() as conn:
+        result = payments.pay(conn, pairs)
+
+    log.debug(f"Paid {len(result['paid'])} of {len(pairs)} orders.")
+    return jsonify(result)
+
+
+@app.route("/analytics/sales", methods=("GET",))
+def analytics_sales():
+    """Quantity and value sold per SKU in a year, in total and per city,
+    month, day of the month and weekday (or the dimensions in ?by=)."""
+
+    try:
+        year, by = analytics.params(request.args, analytics.SALES)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with pool.connection() as conn:
+        # The tag changes with every change to the sales, and names the
+        # cached result.
+        etag = etags.tables(conn, ("product_sales",), "sales", year, by)
+        if request.if_none_match.contains(etag):
+            return etags.not_modified(etag)
+        rows = analytics.sales(conn, year, by, etag)
+
+    return etags.tag(jsonify({"year": year, "by": by, "rows": rows}), etag)
+
+
+@app.route("/analytics/daily-average", methods=("GET",))
+def analytics_daily_average():
+    """Average value sold per day of a year, in total and per month and
+    weekday (or the dimensions in ?by=)."""
+
+    try:
+        year, by = analytics.params(request.args, analytics.DAILY)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with pool.connection() as conn:
+        etag = etags.tables(conn, ("product_sales",), "daily_average", year, by)
+        if request.if_none_match.contains(etag):
+            return etags.not_modified(etag)
+        rows = analytics.daily_average(conn, year, by, etag)
+
+    return etags.tag(jsonify({"year": year, "by": by, "rows": rows}), etag)
+
+
 @app.route("/ping", methods=("GET",))
 def ping():
     log.debug("ping!")
     return jsonify({"message": "pong!", "status": "success"})
 
 
+@app.route("/ping/pool", methods=("GET",))
+def pool_stats():
+    """Connection pool statistics, for sizing the pool per worker."""
+
+    return jsonify(dbpool.stats(pool))
+
+
+@app.route("/metrics", methods=("GET",))
+def metrics_export():
+    """Statement and request timings in the Prometheus text format."""
+
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+@app.route("/export/<name>.<fmt>", methods=("GET",))
+def export_table(name, fmt):
+    """Stream a whole table (or a key or date range of it) as CSV or NDJSON."""
+
+    if name not in export.TABLES or fmt not in export.FORMATS:
+        abort(404)
+    try:
+        filters = export.filters(name, request.args)
+    except ValueError as e:
+        abort(400, str(e))
+
+    return Response(
+        export.stream(pool, name, fmt, **filters),
+        mimetype=export.FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={name}.{fmt}"},
+    )
+
+
 if __name__ == "__main__":
     app.run()
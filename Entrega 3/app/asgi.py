@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+"""ASGI entry point serving the app from an asyncio event loop.
+
+Run with ``hypercorn asgi:application``. Handlers that issue independent
+queries are served by a Quart app on an AsyncConnectionPool and run those
+queries concurrently; every other request is handed to the Flask app in
+app.py unchanged. Both apps share the secret key, so sessions and flashed
+messages carry over between them.
+"""
+import asyncio
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+from psycopg.rows import namedtuple_row
+from psycopg_pool import AsyncConnectionPool
+from quart import Quart
+from quart import abort
+from quart import flash
+from quart import g
+from quart import jsonify
+from quart import make_response
+from quart import redirect
+from quart import render_template
+from quart import request
+from quart import session
+from quart import url_for
+from werkzeug.exceptions import HTTPException
+
+import accounts
+import app as wsgi
+import dbpool
+import etags
+import metrics
+import pagination
+import payments
+
+pool = AsyncConnectionPool(
+    **dbpool.settings(), kwargs={"cursor_factory": metrics.AsyncTimedCursor}, open=False
+)
+
+app = Quart(__name__)
+app.config.update(SECRET_KEY=wsgi.app.config["SECRET_KEY"])
+log = app.logger
+
+
+@app.before_serving
+async def open_pool():
+    await pool.open()
+
+
+@app.after_serving
+async def close_pool():
+    await pool.close()
+
+
+# The same request and statement metrics as the Flask app records.
+@app.before_request
+async def start_timer():
+    g.started = time.perf_counter()
+    metrics.set_route(request.endpoint)
+
+
+@app.after_request
+async def record_timing(response):
+    started = g.pop("started", None)
+    if started is not None:
+        metrics.request_duration.observe(
+            time.perf_counter() - started,
+            metrics.route(),
+            request.method,
+            str(response.status_code),
+        )
+    return response
+
+
+@app.teardown_request
+async def record_failure(exc):
+    # Requests that raised never got to record_timing().
+    started = g.pop("started", None)
+    if started is not None:
+        metrics.request_duration.observe(
+            time.perf_counter() - started, metrics.route(), request.method, "500"
+        )
+
+
+async def fetchall(query, params):
+    """Run ``query`` on a connection of its own and return all the rows."""
+
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=namedtuple_row) as cur:
+            await cur.execute(query, params)
+            return await cur.fetchall()
+
+
+async def fetchone(query, params):
+    """Run ``query`` on a connection of its own and return the first row."""
+
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=namedtuple_row) as cur:
+            await cur.execute(query, params)
+            return await cur.fetchone()
+
+
+async def version(query, params, *parts):
+    """The ETag of the rows described by ``query``, or None with flashes."""
+
+    # Pages carrying flashed messages are never answered with a 304.
+    if "_flashes" in session:
+        return None
+    row = await fetchone(query, params)
+    return etags.make(row.version, *parts)
+
+
+@app.route("/customers/<cust_no>/profile", methods=("GET",))
+async def customer_profile(cust_no):
+
+    wants_json = accounts.wants_json(request)
+
+    async def history():
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=namedtuple_row) as cur:
+                return await pagination.fetch_page_async(
+                    cur, **accounts.history(cust_no, request.args)
+                )
+
+    etag = await version(
+        etags.PROFILE_VERSION, {"cust_no": cust_no}, request.full_path, wants_json
+    )
+    if etag and request.if_none_match.contains(etag):
+        return etags.not_modified(etag, vary="Accept")
+
+    customer_info, page = await asyncio.gather(
+        fetchone(accounts.CUSTOMER, {"cust_no":cust_no}), history()
+    )
+    if customer_info is None:
+        abort(404)
+
+    if wants_json:
+        response = jsonify(accounts.profile(customer_info, page))
+        response.headers["Link"] = pagination.link_header(
+            page, "customer_profile", build=url_for, cust_no=cust_no
+        )
+    else:
+        response = await make_response(await render_template(accounts.PROFILE_TEMPLATE, **accounts.profile_page(customer_info, page)))
+    response.vary.add("Accept")
+    return etags.tag(response, etag) if etag else response
+
+
+@app.route("/customers/<cust_no>/<order_no>", methods=("GET","POST"))
+async def order_status(cust_no, order_no):
+
+    if request.method == "POST":
+        try:
+            pair = (payments.number(cust_no), payments.number(order_no))
+        except (TypeError, ValueError):
+            abort(404)
+        # One statement on one connection; paying again is a no-op.
+        async with pool.connection() as conn:
+            cur = await conn.execute(payments.PAY, payments.params([pair]))
+            result = payments.summary(await cur.fetchall())
+        if result["unknown"]:
+            abort(404)
+        if result["already_paid"]:
+            await flash("The order was already paid.")
+        return redirect(url_for("order_status", order_no=order_no, cust_no=cust_no))
+
+    etag = await version(etags.ORDER_VERSION, {"order_no":order_no, "cust_no":cust_no})
+    if etag and request.if_none_match.contains(etag):
+        return etags.not_modified(etag)
+
+    contains, order = await asyncio.gather(
+        fetchall(accounts.ORDER_LINES, {"order_no":order_no }),
+        fetchone(accounts.ORDER_TOTAL, {"order_no": order_no, "cust_no": cust_no}),
+    )
+
+    response = await make_response(await render_template(accounts.ORDER_TEMPLATE, **accounts.order_page(cust_no, order_no, contains, order)))
+    return etags.tag(response, etag) if etag else response
+
+
+def _served_by_flask(**kwargs):
+    # application() sends requests for these endpoints to Flask before Quart
+    # routes them; should one get here anyway, Quart does not serve it.
+    abort(404)
+
+
+# Register the remaining Flask endpoints too, so url_for() in the templates
+# can build links to them.
+for rule in wsgi.app.url_map.iter_rules():
+    if rule.endpoint not in app.view_functions:
+        app.add_url_rule(rule.rule, rule.endpoint, _served_by_flask, methods=rule.methods)
+
+ASYNC_ENDPOINTS = {"customer_profile", "order_status"}
+
+flask_application = WsgiToAsgi(wsgi.app)
+
+
+async def application(scope, receive, send):
+    """Send requests for the async endpoints to Quart, the rest to Flask."""
+
+    if scope["type"] == "http":
+        adapter = app.url_map.bind("", path_info=scope["path"])
+        try:
+            endpoint, _ = adapter.match(method=scope["method"])
+        except HTTPException:
+            endpoint = None
+        if endpoint not in ASYNC_ENDPOINTS:
+            return await flask_application(scope, receive, send)
+    return await app(scope, receive, send)
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+"""Fill the order totals of orders that existed before they were kept.
+
+migrations/010_order_totals.sql leaves order_total and item_count NULL on
+the orders it found; this prices their lines at the current product price
+and sums them, a range of order numbers per transaction so that no lock is
+held for long and the app keeps running. Running it again only picks up
+what is still missing.
+
+    python backfill.py [--batch N] [--url DATABASE_URL]
+"""
+import argparse
+import sys
+
+import psycopg
+
+from dbpool import DATABASE_URL
+
+
+def backfill(conn, batch):
+    """Fill the missing totals ``batch`` order numbers at a time and yield
+    how many orders each range had."""
+
+    first, last = conn.execute(
+        "SELECT min(order_no), max(order_no) FROM orders WHERE order_total IS NULL;"
+    ).fetchone()
+    if first is None:
+        return
+    for start in range(first, last + 1, batch):
+        with conn.transaction():
+            n = conn.execute(
+                "SELECT order_totals_backfill(%(first)s, %(last)s);",
+                {"first": start, "last": start + batch - 1},
+            ).fetchone()[0]
+        yield start, n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--url", default=DATABASE_URL)
+    args = parser.parse_args(argv)
+
+    total = 0
+    with psycopg.connect(args.url, autocommit=True) as conn:
+        for start, n in backfill(conn, args.batch):
+            total += n
+            if n:
+                print(f"orders {start}-{start + args.batch - 1}: {n}")
+    print(f"filled {total} orders")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
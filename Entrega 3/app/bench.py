@@ -0,0 +1,385 @@
+#!/usr/bin/python3
+"""HTTP benchmark of the app: a fixed mix of requests at fixed concurrency.
+
+    python bench.py run --serve --generate --duration 30 --out before.json
+    python bench.py run --base-url http://127.0.0.1:5000 --mix products=1,checkout=1
+    python bench.py compare before.json after.json --threshold 0.1
+
+``run`` sends requests from ``--concurrency`` threads for ``--duration``
+seconds, picking actions from ``--mix`` by weight with a seeded random
+generator, and prints (or writes to ``--out``) the throughput and the
+p50/p95/p99 latencies of every route as JSON. With ``--generate`` the
+database is first filled by loader.py, and with ``--serve`` the app is
+started against it on ``--port`` for the length of the run. The customers,
+orders and products the actions use are read from the database at start.
+
+``compare`` reports the change of every figure between two runs and exits
+with status 1 if a route got slower (or its throughput dropped) by more
+than ``--threshold``.
+"""
+import argparse
+import collections
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+import psycopg
+from psycopg import sql
+
+import loader
+import pagination
+from dbpool import DATABASE_URL
+
+# Relative weight of every action when --mix is not given.
+MIX = {
+    "products": 4,
+    "customers": 3,
+    "profile": 2,
+    "order": 2,
+    "checkout": 1,
+    "pay": 1,
+    "delete": 0.2,
+}
+
+# Share of the customers kept for the delete action; no other action uses them.
+DELETABLE = 0.1
+
+# Rows per page of the listings, as the app shows them.
+PER_PAGE = 5
+
+# Most listing pages sampled, spread evenly from the first to the last.
+SAMPLED_PAGES = 1000
+
+PERCENTILES = (50, 95, 99)
+
+
+class Fixtures:
+    """The rows the actions act on, read from the database at start."""
+
+    def __init__(self, url):
+        with psycopg.connect(url) as conn:
+            customers = [row[0] for row in conn.execute("SELECT cust_no FROM customer ORDER BY cust_no;")]
+            kept = len(customers) - int(len(customers) * DELETABLE)
+            self.customers = customers[:kept]
+            self.deletable = collections.deque(customers[kept:])
+            last = self.customers[-1] if self.customers else 0
+            self.orders = conn.execute(
+                """
+                SELECT cust_no, order_no FROM orders
+                WHERE cust_no <= %(last)s
+                ORDER BY order_no LIMIT 100000;
+                """,
+                {"last": last},
+            ).fetchall()
+            self.unpaid = collections.deque(
+                conn.execute(
+                    """
+                    SELECT cust_no, order_no FROM orders o
+                    WHERE cust_no <= %(last)s
+                    AND NOT EXISTS (SELECT 1 FROM pay p WHERE p.order_no = o.order_no)
+                    ORDER BY order_no LIMIT 100000;
+                    """,
+                    {"last": last},
+                ).fetchall()
+            )
+            self.skus = [row[0] for row in conn.execute("SELECT sku FROM product ORDER BY sku LIMIT 10000;")]
+            self.customer_pages = self.pages(conn, "customer", ("cust_no",))
+            self.product_pages = self.pages(conn, "product", ("price", "sku"))
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def pages(conn, table, keys):
+        """(page, after) of listing pages of ``table`` ordered by ``keys``, with
+        the cursors the app puts in its links, so deep pages are read too."""
+
+        rows = conn.execute(
+            sql.SQL(
+                """
+                SELECT n / %(per_page)s + 1, {keys}
+                FROM (
+                    SELECT {keys}, row_number() OVER (ORDER BY {keys}) AS n,
+                           count(*) OVER () AS total
+                    FROM {table}
+                ) AS listing
+                WHERE n < total
+                AND n %% (%(per_page)s * greatest(1, total / (%(per_page)s * %(sampled)s))) = 0
+                ORDER BY n;
+                """
+            ).format(
+                keys=sql.SQL(", ").join(map(sql.Identifier, keys)),
+                table=sql.Identifier(table),
+            ),
+            {"per_page": PER_PAGE, "sampled": SAMPLED_PAGES},
+        ).fetchall()
+        return [(1, None)] + [(page, pagination.encode_cursor(key)) for page, *key in rows]
+
+    def take(self, queue):
+        """The next unused row of ``queue``, or None once it ran out."""
+
+        with self.lock:
+            return queue.popleft() if queue else None
+
+
+class Client:
+    """One keep-alive connection to the app, with its session cookie."""
+
+    def __init__(self, base_url):
+        url = urllib.parse.urlsplit(base_url)
+        self.connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+        self.cookie = None
+
+    def request(self, method, path, form=None):
+        """Send a request and return its status and how long it took."""
+
+        headers = {"Accept": "text/html"}
+        body = None
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            return 0, time.perf_counter() - started
+        elapsed = time.perf_counter() - started
+
+        cookie = response.getheader("Set-Cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        return response.status, elapsed
+
+
+def listing(path, page, after):
+    """The URL of a listing page, as the app links to it."""
+
+    query = {"page": page}
+    if after is not None:
+        query["after"] = after
+    return f"{path}?{urllib.parse.urlencode(query)}"
+
+
+def action(name, client, fixtures, r):
+    """Run action ``name`` and return its (route, status, seconds) samples."""
+
+    if name == "products":
+        path = listing("/products", *r.choice(fixtures.product_pages))
+        return [("GET /products", *client.request("GET", path))]
+    if name == "customers":
+        path = listing("/customers", *r.choice(fixtures.customer_pages))
+        return [("GET /customers", *client.request("GET", path))]
+    if name == "profile":
+        cust_no = r.choice(fixtures.customers)
+        return [("GET profile", *client.request("GET", f"/customers/{cust_no}/profile"))]
+    if name == "order":
+        cust_no, order_no = r.choice(fixtures.orders)
+        return [("GET order", *client.request("GET", f"/customers/{cust_no}/{order_no}"))]
+    if name == "checkout":
+        cust_no = r.choice(fixtures.customers)
+        path = f"/customers/{cust_no}/make_order"
+        samples = []
+        for sku in r.sample(fixtures.skus, min(len(fixtures.skus), r.randint(1, 3))):
+            samples.append(("POST make_order add", *client.request("POST", path, {"add": sku, sku: r.randint(1, 3)})))
+        samples.append(("POST make_order checkout", *client.request("POST", path, {"checkout": ""})))
+        return samples
+    if name == "pay":
+        order = fixtures.take(fixtures.unpaid)
+        if order is None:
+            return []
+        cust_no, order_no = order
+        return [("POST pay", *client.request("POST", f"/customers/{cust_no}/{order_no}", {}))]
+    if name == "delete":
+        cust_no = fixtures.take(fixtures.deletable)
+        if cust_no is None:
+            return []
+        return [("POST delete customer", *client.request("POST", f"/customers/{cust_no}/delete", {}))]
+    raise ValueError(f"unknown action {name}")
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of a sorted list."""
+
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+
+def summary(samples, duration):
+    """Throughput and latencies (in milliseconds) per route."""
+
+    routes = {}
+    by_route = collections.defaultdict(list)
+    for route, status, seconds in samples:
+        by_route[route].append((status, seconds))
+    for route, results in sorted(by_route.items()):
+        latencies = sorted(seconds * 1000 for _, seconds in results)
+        routes[route] = {
+            "count": len(results),
+            "errors": sum(1 for status, _ in results if not 200 <= status < 400),
+            "throughput": round(len(results) / duration, 2),
+            "mean": round(sum(latencies) / len(latencies), 2),
+            **{f"p{p}": round(percentile(latencies, p), 2) for p in PERCENTILES},
+            "max": round(latencies[-1], 2),
+        }
+    return {
+        "requests": len(samples),
+        "errors": sum(route["errors"] for route in routes.values()),
+        "throughput": round(len(samples) / duration, 2),
+        "routes": routes,
+    }
+
+
+def run(base_url, fixtures, mix, duration, concurrency, seed):
+    """Drive the app and return the summary of the run."""
+
+    names, weights = zip(*mix.items())
+    samples = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(n):
+        r = random.Random(f"{seed}:{n}")
+        client = Client(base_url)
+        mine = []
+        while time.monotonic() < deadline:
+            mine.extend(action(r.choices(names, weights)[0], client, fixtures, r))
+        with lock:
+            samples.extend(mine)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summary(samples, time.monotonic() - started)
+
+
+def serve(database_url, port):
+    """Start the app on ``port`` and wait until it answers."""
+
+    env = dict(os.environ, DATABASE_URL=database_url)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port), "--with-threads"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    client = Client(f"http://127.0.0.1:{port}")
+    for _ in range(300):
+        if client.request("GET", "/ping")[0] == 200:
+            return process
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("the app did not start")
+
+
+def compare(base, new, threshold):
+    """The relative change of every figure, and the regressions among them."""
+
+    changes, regressions = {}, []
+    for route in sorted(set(base["routes"]) & set(new["routes"])):
+        before, after = base["routes"][route], new["routes"][route]
+        changes[route] = {}
+        for figure in ("throughput", "mean", *(f"p{p}" for p in PERCENTILES)):
+            if not before[figure]:
+                continue
+            change = after[figure] / before[figure] - 1
+            changes[route][figure] = round(change, 3)
+            # Higher is better for throughput only.
+            worse = -change if figure == "throughput" else change
+            if worse > threshold:
+                regressions.append(f"{route} {figure}: {before[figure]} -> {after[figure]}")
+    return {"changes": changes, "regressions": regressions}
+
+
+def weights(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in MIX:
+            raise argparse.ArgumentTypeError(f"unknown action {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_command = commands.add_parser("run", help="benchmark the app")
+    run_command.add_argument("--database", default=DATABASE_URL)
+    run_command.add_argument("--base-url", default=None)
+    run_command.add_argument("--serve", action="store_true", help="start the app for the run")
+    run_command.add_argument("--port", type=int, default=5055)
+    run_command.add_argument("--generate", action="store_true", help="load generated data first")
+    run_command.add_argument("--customers", type=int, default=10000)
+    run_command.add_argument("--orders", type=int, default=50000)
+    run_command.add_argument("--products", type=int, default=2000)
+    run_command.add_argument("--duration", type=float, default=30)
+    run_command.add_argument("--concurrency", type=int, default=8)
+    run_command.add_argument("--mix", type=weights, default=MIX)
+    run_command.add_argument("--seed", type=int, default=1)
+    run_command.add_argument("--out", type=argparse.FileType("w"), default=sys.stdout)
+
+    compare_command = commands.add_parser("compare", help="compare two runs")
+    compare_command.add_argument("base", type=argparse.FileType())
+    compare_command.add_argument("new", type=argparse.FileType())
+    compare_command.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        result = compare(json.load(args.base), json.load(args.new), args.threshold)
+        json.dump(result, sys.stdout, indent=2)
+        print()
+        return 1 if result["regressions"] else 0
+
+    if args.generate:
+        loader.main([
+            "--url", args.database, "generate", "--seed", str(args.seed),
+            "--customers", str(args.customers), "--orders", str(args.orders),
+            "--products", str(args.products),
+        ])
+    fixtures = Fixtures(args.database)
+
+    process = serve(args.database, args.port) if args.serve else None
+    try:
+        report = run(
+            args.base_url or f"http://127.0.0.1:{args.port}",
+            fixtures,
+            args.mix,
+            args.duration,
+            args.concurrency,
+            args.seed,
+        )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = {
+        "config": {
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "seed": args.seed,
+        },
+        **report,
+    }
+    json.dump(report, args.out, indent=2)
+    args.out.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+"""Bulk import of customers, products and suppliers from CSV.
+
+The file is streamed with ``COPY FROM STDIN`` into a temporary staging table
+of text columns, so no value can make the copy itself fail. Every staged row
+is then checked with the rules of the registration forms in one UPDATE, and
+the rows that pass are merged into the real table with a single
+``INSERT ... ON CONFLICT``. Rejected rows are reported by line and do not
+stop the rest of the batch.
+
+    python bulk.py products catalog.csv [DATABASE_URL] > rejected.csv
+
+The first line of the file names its columns, in any order.
+"""
+import csv
+import sys
+
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+
+from dbpool import DATABASE_URL
+
+# Bytes handed to COPY at a time.
+CHUNK = 64 * 1024
+
+# Per kind: the table, the columns a file may have, the ones it must have
+# and the optional ones a quoted empty value leaves out, the reasons a staged row is rejected (checked in order, in line with
+# customer_add, product_add and supplier_add), and how rows are merged.
+KINDS = {
+    "customers": {
+        "table": "customer",
+        "columns": ("name", "email", "phone", "address"),
+        "required": ("name", "email", "phone", "address"),
+        "rules": (
+            ("coalesce(name, '') = ''", "Name is required."),
+            ("coalesce(email, '') = ''", "Email is required."),
+            ("coalesce(address, '') = ''", "Address is required."),
+            ("coalesce(phone, '') = ''", "Phone is required."),
+            ("phone !~ '^[0-9]{1,15}$'", "Phone is required to be max 15 digits."),
+            ("name ~ '[[:digit:]]'", "Name is required to be only characters."),
+            ("length(name) > 80", "Name is longer than 80 characters."),
+            ("length(email) > 254", "Email is longer than 254 characters."),
+            ("length(address) > 255", "Address is longer than 255 characters."),
+        ),
+        "key": "email",
+        "insert": "name, email, phone, address",
+        "values": "name, email, phone, address",
+        "update": "name = EXCLUDED.name, phone = EXCLUDED.phone, address = EXCLUDED.address",
+    },
+    "products": {
+        "table": "product",
+        "columns": ("sku", "name", "description", "price", "ean"),
+        "required": ("sku", "name", "description", "price"),
+        "optional": ("ean",),
+        "rules": (
+            ("coalesce(sku, '') = ''", "SKU is required."),
+            ("coalesce(name, '') = ''", "Name is required."),
+            ("coalesce(description, '') = ''", "Description is required."),
+            ("coalesce(price, '') = ''", "Price is required."),
+            ("price !~ '^[0-9]{1,8}(\\.[0-9]*)?$'", "Price is required to be numeric."),
+            ("price::numeric = 0", "Price is required to be numeric."),
+            ("ean !~ '^[0-9]{1,13}$'", "EAN is required to be numeric."),
+            ("length(sku) > 25", "SKU is longer than 25 characters."),
+            ("length(name) > 200", "Name is longer than 200 characters."),
+            (
+                "EXISTS (SELECT 1 FROM product p WHERE p.ean = s.ean::numeric AND p.sku <> s.sku)",
+                "EAN already belongs to another product.",
+            ),
+            (
+                "EXISTS (SELECT 1 FROM staging o WHERE o.ean = s.ean AND o.sku <> s.sku)",
+                "EAN is repeated in the file for another SKU.",
+            ),
+        ),
+        "key": "sku",
+        "insert": "sku, name, description, price, ean",
+        "values": "sku, name, description, price::numeric(10, 2), ean::numeric",
+        "update": "name = EXCLUDED.name, description = EXCLUDED.description,"
+        " price = EXCLUDED.price, ean = EXCLUDED.ean",
+    },
+    "suppliers": {
+        "table": "supplier",
+        "columns": ("tin", "name", "address", "sku"),
+        "required": ("tin", "name", "address", "sku"),
+        "rules": (
+            ("coalesce(name, '') = ''", "Name is required."),
+            ("coalesce(address, '') = ''", "Address is required."),
+            ("coalesce(tin, '') = ''", "TIN is required."),
+            ("tin !~ '^[0-9]{1,20}$'", "TIN is required to be max 20 digits."),
+            ("length(name) > 200", "Name is longer than 200 characters."),
+            ("length(address) > 255", "Address is longer than 255 characters."),
+            (
+                "NOT EXISTS (SELECT 1 FROM product p WHERE p.sku = s.sku)",
+                "SKU does not exist.",
+            ),
+            # Moving a supplier to another product would throw off the
+            # per-product supplier counts.
+            (
+                "EXISTS (SELECT 1 FROM supplier o WHERE o.tin = s.tin AND o.sku <> s.sku)",
+                "TIN already exists for another product.",
+            ),
+        ),
+        "key": "tin",
+        "insert": "tin, name, address, sku, date",
+        "values": "tin, name, address, sku, current_date",
+        "update": "name = EXCLUDED.name, address = EXCLUDED.address",
+    },
+}
+
+
+def header(source, kind):
+    """Read the first line of ``source`` and return the columns it names.
+
+    Raises ValueError if it names a column ``kind`` does not have, repeats
+    one, or misses a required one.
+    """
+
+    line = source.readline()
+    if isinstance(line, bytes):
+        line = line.decode("utf-8-sig")
+    names = [name.strip().lower() for name in next(csv.reader([line]), [])]
+    spec = KINDS[kind]
+    if (
+        any(name not in spec["columns"] for name in names)
+        or any(name not in names for name in spec["required"])
+        or len(set(names)) != len(names)
+    ):
+        raise ValueError(
+            f"The first line must name the columns of {kind}:"
+            f" {', '.join(spec['columns'])}"
+            f" (required: {', '.join(spec['required'])})."
+        )
+    return names
+
+
+def load(conn, kind, source):
+    """Import the CSV file ``source`` (header line first) of ``kind``.
+
+    Returns the number of rows inserted and updated and the rejected rows,
+    each with its line in the file and the reason. Raises ValueError, and
+    imports nothing, if the header or the CSV itself is malformed.
+    """
+
+    spec = KINDS[kind]
+    names = header(source, kind)
+    columns = sql.SQL(", ").join(map(sql.Identifier, spec["columns"]))
+    key = sql.Identifier(spec["key"])
+
+    with conn.transaction(), conn.cursor(row_factory=dict_row) as cur:
+        # Lines are numbered as in the file, whose first line is the header.
+        cur.execute(
+            sql.SQL(
+                """
+                CREATE TEMPORARY TABLE staging(
+                line BIGINT GENERATED ALWAYS AS IDENTITY (START WITH 2),
+                {},
+                error TEXT
+                ) ON COMMIT DROP;
+                """
+            ).format(
+                sql.SQL(", ").join(
+                    sql.SQL("{} TEXT").format(sql.Identifier(c)) for c in spec["columns"]
+                )
+            )
+        )
+        # CSV reads only an unquoted empty value as NULL; "" is kept as ''.
+        optional = [name for name in names if name in spec.get("optional", ())]
+        statement = sql.SQL("COPY staging ({}) FROM STDIN WITH (FORMAT csv{})").format(
+            sql.SQL(", ").join(map(sql.Identifier, names)),
+            sql.SQL(", FORCE_NULL ({})").format(
+                sql.SQL(", ").join(map(sql.Identifier, optional))
+            )
+            if optional
+            else sql.SQL(""),
+        )
+        try:
+            with cur.copy(statement) as copy:
+                while data := source.read(CHUNK):
+                    copy.write(data)
+        except psycopg.errors.DataError as e:
+            # Only a file that is not well-formed CSV fails as a whole.
+            raise ValueError(str(e).strip()) from e
+
+        cur.execute(
+            sql.SQL("UPDATE staging s SET error = CASE {} END;").format(
+                sql.SQL(" ").join(
+                    sql.SQL("WHEN {} THEN {}").format(sql.SQL(rule), reason)
+                    for rule, reason in spec["rules"]
+                )
+            )
+        )
+        # ON CONFLICT cannot change a row twice: the last line of a key wins.
+        cur.execute(
+            sql.SQL(
+                """
+                UPDATE staging s
+                SET error = 'Replaced by line ' || o.last || '.'
+                FROM (
+                    SELECT line, max(line) OVER (PARTITION BY {}) AS last
+                    FROM staging
+                    WHERE error IS NULL
+                ) o
+                WHERE s.line = o.line AND o.line < o.last;
+                """
+            ).format(key)
+        )
+        merged = cur.execute(
+            sql.SQL(
+                """
+                WITH merged AS (
+                    INSERT INTO {} ({})
+                    SELECT {} FROM staging WHERE error IS NULL ORDER BY line
+                    ON CONFLICT ({}) DO UPDATE SET {}
+                    RETURNING xmax = 0 AS inserted
+                )
+                SELECT count(*) FILTER (WHERE inserted) AS inserted,
+                       count(*) FILTER (WHERE NOT inserted) AS updated
+                FROM merged;
+                """
+            ).format(
+                sql.Identifier(spec["table"]),
+                sql.SQL(spec["insert"]),
+                sql.SQL(spec["values"]),
+                key,
+                sql.SQL(spec["update"]),
+            )
+        ).fetchone()
+        rejected = cur.execute(
+            sql.SQL(
+                """
+                SELECT line, error, {}
+                FROM staging
+                WHERE error IS NOT NULL
+                ORDER BY line;
+                """
+            ).format(columns)
+        ).fetchall()
+
+    return {**merged, "rejected": rejected}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in KINDS:
+        sys.exit(f"usage: {sys.argv[0]} {{{'|'.join(KINDS)}}} FILE [DATABASE_URL]")
+    kind, path = sys.argv[1], sys.argv[2]
+    url = sys.argv[3] if len(sys.argv) > 3 else DATABASE_URL
+
+    with psycopg.connect(url) as conn, open(path, "rb") as source:
+        try:
+            result = load(conn, kind, source)
+        except ValueError as e:
+            sys.exit(str(e))
+
+    # Rejected rows go to stdout as CSV, so they can be fixed and imported again.
+    writer = csv.DictWriter(sys.stdout, ("line", "error") + KINDS[kind]["columns"])
+    writer.writeheader()
+    writer.writerows(result["rejected"])
+    print(
+        f"{result['inserted']} inserted, {result['updated']} updated,"
+        f" {len(result['rejected'])} rejected",
+        file=sys.stderr,
+    )
@@ -0,0 +1,101 @@
+"""Shopping carts of the customers, stored in the cart_item table.
+
+Every change is one statement keyed by the customer and SKU, and the lines
+of a cart are read with their prices and subtotals in one query, so the
+cost of a cart request does not depend on the size of the cart. Nothing
+about the cart travels in the session or in URLs.
+"""
+import collections
+
+from psycopg.rows import namedtuple_row
+
+Cart = collections.namedtuple("Cart", "lines total quantities")
+
+
+def update(conn, cust_no, sku, qty):
+    """Set the quantity of ``sku`` in the cart; zero or less removes it."""
+
+    if qty <= 0:
+        remove(conn, cust_no, sku)
+        return
+    conn.execute(
+        """
+        INSERT INTO cart_item (cust_no, sku, qty)
+        VALUES (%(cust_no)s, %(sku)s, %(qty)s)
+        ON CONFLICT (cust_no, sku) DO UPDATE SET qty = excluded.qty;
+        """,
+        {"cust_no": cust_no, "sku": sku, "qty": qty},
+    )
+
+
+def remove(conn, cust_no, sku):
+    conn.execute(
+        "DELETE FROM cart_item WHERE cust_no = %(cust_no)s AND sku = %(sku)s;",
+        {"cust_no": cust_no, "sku": sku},
+    )
+
+
+def is_empty(conn, cust_no):
+    """Whether the cart of ``cust_no`` has no lines.
+
+    Inside a transaction, the line found stays locked until it ends, so a
+    checkout() that follows still finds the cart not empty.
+    """
+
+    return conn.execute(
+        "SELECT FROM cart_item WHERE cust_no = %(cust_no)s LIMIT 1 FOR UPDATE;",
+        {"cust_no": cust_no},
+    ).fetchone() is None
+
+
+def get(conn, cust_no):
+    """The lines of the cart of ``cust_no`` with their current prices."""
+
+    with conn.cursor(row_factory=namedtuple_row) as cur:
+        lines = cur.execute(
+            """
+            SELECT sku, name, qty, price, qty * price AS subtotal
+            FROM cart_item
+            JOIN product USING (sku)
+            WHERE cust_no = %(cust_no)s
+            ORDER BY added, sku;
+            """,
+            {"cust_no": cust_no},
+        ).fetchall()
+    return Cart(
+        lines=lines,
+        total=sum(line.subtotal for line in lines),
+        quantities={line.sku: line.qty for line in lines},
+    )
+
+
+def checkout(conn, cust_no, order_no):
+    """Turn the cart into an order and empty it, in one statement.
+
+    ``order_no`` may be None to draw the number from the sequence. Returns
+    the new order number, or None if the cart was empty. Call it inside a
+    transaction.
+    """
+
+    row = conn.execute(
+        """
+        WITH items AS (
+            DELETE FROM cart_item
+            WHERE cust_no = %(cust_no)s
+            RETURNING sku, qty
+        ), new_order AS (
+            INSERT INTO orders
+            SELECT coalesce(%(order_no)s, nextval(pg_get_serial_sequence('orders', 'order_no'))),
+                   %(cust_no)s, current_date
+            WHERE EXISTS (SELECT FROM items)
+            RETURNING order_no
+        ), lines AS (
+            INSERT INTO contains
+            SELECT new_order.order_no, items.sku, items.qty
+            FROM new_order, items
+        )
+        SELECT order_no FROM new_order;
+        """,
+        {"cust_no": cust_no, "order_no": order_no},
+    ).fetchone()
+    return row[0] if row else None
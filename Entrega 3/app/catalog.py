@@ -0,0 +1,96 @@
+"""Read-through cache of the product catalog.
+
+Catalog pages (keyed by their cursor) and single product rows are kept in a
+small in-process LRU, keyed as well by the version row_count keeps for the
+product table (see migrations/003_table_version.sql). Every write to product
+bumps that version when it commits, so a worker never serves what it read
+before the change, whoever made it, and nothing needs to be invalidated.
+The version is read before the data, so an entry is never older than its
+key says.
+"""
+import collections
+import os
+import threading
+
+from psycopg.rows import namedtuple_row
+
+import pagination
+
+# Most entries kept; the least recently used go first. Entries of older
+# versions are never asked for again and are the first to go.
+SIZE = int(os.environ.get("CATALOG_SIZE", 256))
+
+_entries = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def _get(key):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+        return entry
+
+
+def _put(key, value):
+    with _lock:
+        _entries[key] = (value,)
+        _entries.move_to_end(key)
+        while len(_entries) > SIZE:
+            _entries.popitem(last=False)
+
+
+def current_version(conn):
+    """The version of the product table as of now."""
+
+    row = conn.execute(
+        "SELECT version FROM row_count WHERE tbl = 'product' AND scope = '';"
+    ).fetchone()
+    return row[0] if row else None
+
+
+def page(conn, after=None, page=1, per_page=5, version=None):
+    """The catalog page after ``after``, ordered by price.
+
+    ``version`` is the version of product the caller already read, e.g. to
+    tag its response; it is read here otherwise.
+    """
+
+    if version is None:
+        version = current_version(conn)
+    key = ("page", version, per_page, after, page)
+    entry = _get(key)
+    if entry is not None:
+        return entry[0]
+
+    with conn.cursor(row_factory=namedtuple_row) as cur:
+        result = pagination.fetch_page(
+            cur,
+            "product",
+            ("sku", "name", "description", "price"),
+            ("price", "sku"),
+            after=after,
+            page=page,
+            per_page=per_page,
+        )
+    _put(key, result)
+    return result
+
+
+def product(conn, sku):
+    """The product row of ``sku``, or None."""
+
+    key = ("product", current_version(conn), sku)
+    entry = _get(key)
+    if entry is not None:
+        return entry[0]
+
+    with conn.cursor(row_factory=namedtuple_row) as cur:
+        result = cur.execute(
+            """
+            SELECT * FROM product WHERE sku = %(sku)s;
+            """,
+            {"sku": sku},
+        ).fetchone()
+    _put(key, result)
+    return result
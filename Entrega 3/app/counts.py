@@ -0,0 +1,94 @@
+"""Row counts for drawing pagination without scanning whole tables.
+
+Exact counts come from the row_count table, which triggers keep up to date
+(see migrations/001_row_count.sql). In "estimated" mode unscoped counts are
+read from the planner statistics in pg_class instead. Either way the result
+is cached in-process for a few seconds.
+"""
+import os
+import threading
+import time
+
+from psycopg.rows import namedtuple_row
+
+# "exact" reads the trigger-maintained counters, "estimated" reads pg_class.
+MODE = os.environ.get("COUNT_MODE", "exact")
+
+# Seconds a count is served from the cache before it is read again.
+TTL = float(os.environ.get("COUNT_TTL", 10))
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _exact(cur, table, scope):
+    row = cur.execute(
+        """
+        SELECT total
+        FROM row_count
+        WHERE tbl = %(tbl)s AND scope = %(scope)s;
+        """,
+        {"tbl": table, "scope": scope},
+    ).fetchone()
+    return row.total if row is not None else 0
+
+
+def _estimated(cur, table):
+    row = cur.execute(
+        """
+        SELECT reltuples::bigint AS total
+        FROM pg_class
+        WHERE oid = to_regclass(%(tbl)s);
+        """,
+        {"tbl": table},
+    ).fetchone()
+    # Tables that were never vacuumed or analyzed report -1.
+    return row.total if row is not None and row.total >= 0 else None
+
+
+def count(conn, table, scope="", mode=None):
+    """Return the number of rows of ``table`` (within ``scope``, if given)."""
+
+    mode = mode or MODE
+    key = (table, scope, mode)
+    now = time.monotonic()
+    with _lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    with conn.cursor(row_factory=namedtuple_row) as cur:
+        total = None
+        if mode == "estimated" and not scope:
+            total = _estimated(cur, table)
+        if total is None:
+            total = _exact(cur, table, scope)
+
+    with _lock:
+        _cache[key] = (now + TTL, total)
+    return total
+
+
+def versioned(conn, table, scope=""):
+    """The exact count of ``table`` and the version of the same row_count
+    row, read together and never cached, for responses tagged with that
+    version."""
+
+    row = conn.execute(
+        """
+        SELECT total, version
+        FROM row_count
+        WHERE tbl = %(tbl)s AND scope = %(scope)s;
+        """,
+        {"tbl": table, "scope": scope},
+    ).fetchone()
+    return tuple(row) if row is not None else (0, None)
+
+
+def invalidate(table, scope=None):
+    """Forget the cached counts of ``table`` after this process changed it."""
+
+    with _lock:
+        for key in list(_cache):
+            if key[0] == table and (scope is None or key[1] == scope):
+                del _cache[key]
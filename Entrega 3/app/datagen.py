@@ -0,0 +1,173 @@
+"""Deterministic synthetic data for the shop schema, for scale testing.
+
+Every row is computed from the seed and its own number, so each table can be
+streamed on its own in constant memory and the same seed always gives the
+same data set. The rows respect the schema's rules: employees are adults
+(RI-1), every order has at least one line in contains (RI-3, the deferred
+check_order trigger), payments are made by the customer who placed the
+order, and customer names have no digits, as customer_add requires.
+Workplaces are not generated, so RI-2 is not involved.
+"""
+import datetime
+import random
+from decimal import Decimal
+
+# Load order; each table only refers to the ones before it.
+TABLES = ("employee", "product", "customer", "orders", "contains", "pay", "process")
+
+COLUMNS = {
+    "employee": ("ssn", "tin", "bdate", "name"),
+    "product": ("sku", "name", "description", "price", "ean"),
+    "customer": ("cust_no", "name", "email", "phone", "address"),
+    "orders": ("order_no", "cust_no", "date"),
+    "contains": ("order_no", "sku", "qty", "unit_price"),
+    "pay": ("order_no", "cust_no"),
+    "process": ("ssn", "order_no"),
+}
+
+FIRST_NAMES = (
+    "Ana", "Beatriz", "Carolina", "Daniel", "Diogo", "Francisca", "Gonçalo",
+    "Inês", "João", "Jorge", "Leonor", "Maria", "Miguel", "Pedro", "Rita",
+    "Rodrigo", "Sofia", "Tiago",
+)
+LAST_NAMES = (
+    "Almeida", "Carvalho", "Costa", "Ferreira", "Gomes", "Lopes", "Martins",
+    "Oliveira", "Pereira", "Ribeiro", "Rodrigues", "Santos", "Silva", "Sousa",
+)
+STREETS = (
+    "Rua da Liberdade", "Rua do Diogo", "Largo do Convento", "Av. da Igreja",
+    "Rua de Santa Catarina", "Av. da República", "Rua Augusta",
+)
+CITIES = (
+    "Lisboa", "Porto", "Coimbra", "Braga", "Leiria", "Faro", "Aveiro",
+    "Viana do Castelo", "Évora", "Setúbal", "Quarteira", "Portalegre",
+)
+ADJECTIVES = ("Classic", "Slim", "Vintage", "Sport", "Winter", "Summer", "Basic")
+NOUNS = ("Jeans", "Jacket", "Sneakers", "Shirt", "Dress", "Hoodie", "Suit", "Cap")
+
+# Orders are placed over two years.
+FIRST_DAY = datetime.date(2022, 1, 1)
+DAYS = 730
+
+# Share of orders that are paid.
+PAID = 0.7
+
+
+class Generator:
+    """The rows of a data set of the given size.
+
+    Customers and orders are numbered from ``first_customer`` and
+    ``first_order``, so a data set can be added next to existing rows. Keys
+    of the other tables carry the seed, so data sets of different seeds can
+    be loaded into the same database.
+    """
+
+    def __init__(self, seed=1, customers=1000, orders=5000, products=500,
+                 employees=50, first_customer=1, first_order=1):
+        if orders and not (customers and products):
+            raise ValueError("orders need at least one customer and one product")
+        self.seed = seed
+        self.customers = customers
+        self.orders = orders
+        self.products = products
+        self.employees = employees
+        self.first_customer = first_customer
+        self.first_order = first_order
+
+    def _random(self, table, n):
+        return random.Random(f"{self.seed}:{table}:{n}")
+
+    def sku(self, n):
+        return f"G{self.seed}-{n:08d}"
+
+    def ssn(self, n):
+        return f"G{self.seed}-{n:08d}"
+
+    def price(self, n):
+        """The price of product ``n``, which its order lines are sold at."""
+
+        r = self._random("product", n)
+        r.choice(ADJECTIVES), r.choice(NOUNS)
+        return Decimal(r.randint(100, 50000)) / 100
+
+    def rows(self, table):
+        """Yield the rows of ``table``, as tuples in COLUMNS order."""
+
+        return getattr(self, f"_{table}")()
+
+    def _employee(self):
+        for n in range(self.employees):
+            r = self._random("employee", n)
+            yield (
+                self.ssn(n),
+                f"T{self.seed}-{n:08d}",
+                datetime.date(r.randint(1950, 2000), r.randint(1, 12), r.randint(1, 28)),
+                f"{r.choice(FIRST_NAMES)} {r.choice(LAST_NAMES)}",
+            )
+
+    def _product(self):
+        for n in range(self.products):
+            r = self._random("product", n)
+            name = f"{r.choice(ADJECTIVES)} {r.choice(NOUNS)}"
+            yield (
+                self.sku(n),
+                name,
+                f"{name} from the generated catalog.",
+                self.price(n),
+                # 13 digits, unique per seed (mod 1000) and product.
+                int(f"2{self.seed % 1000:03d}{n:09d}"),
+            )
+
+    def _customer(self):
+        for n in range(self.customers):
+            r = self._random("customer", n)
+            cust_no = self.first_customer + n
+            yield (
+                cust_no,
+                f"{r.choice(FIRST_NAMES)} {r.choice(LAST_NAMES)}",
+                f"customer{cust_no}.{self.seed}@example.com",
+                f"9{r.randrange(10 ** 8):08d}",
+                f"{r.choice(STREETS)} n{r.randint(1, 300)}"
+                f" {r.randint(1000, 9999)}-{r.randint(100, 999)}, {r.choice(CITIES)}",
+            )
+
+    def order(self, n):
+        """Everything about order ``n``, drawn in one fixed sequence."""
+
+        r = self._random("orders", n)
+        cust_no = self.first_customer + r.randrange(self.customers)
+        date = FIRST_DAY + datetime.timedelta(days=r.randrange(DAYS))
+        lines = [
+            (self.sku(p), r.randint(1, 5), self.price(p))
+            for p in r.sample(range(self.products), r.randint(1, min(5, self.products)))
+        ]
+        paid = r.random() < PAID
+        staff = (
+            [self.ssn(e) for e in r.sample(range(self.employees), r.randint(1, min(2, self.employees)))]
+            if self.employees
+            else []
+        )
+        return self.first_order + n, cust_no, date, lines, paid, staff
+
+    def _orders(self):
+        for n in range(self.orders):
+            order_no, cust_no, date, *_ = self.order(n)
+            yield order_no, cust_no, date
+
+    def _contains(self):
+        for n in range(self.orders):
+            order_no, _, _, lines, *_ = self.order(n)
+            for sku, qty, price in lines:
+                yield order_no, sku, qty, price
+
+    def _pay(self):
+        for n in range(self.orders):
+            order_no, cust_no, _, _, paid, _ = self.order(n)
+            if paid:
+                yield order_no, cust_no
+
+    def _process(self):
+        for n in range(self.orders):
+            order_no, *_, staff = self.order(n)
+            for ssn in staff:
+                yield ssn, order_no
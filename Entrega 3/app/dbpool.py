@@ -0,0 +1,70 @@
+"""Connection pool settings, all of which can be set from the environment."""
+import os
+import time
+
+from psycopg_pool import ConnectionPool
+from psycopg_pool import PoolTimeout
+
+import metrics
+import querylog
+
+# postgres://{user}:{password}@{hostname}:{port}/{database-name}
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgres://db:db@postgres/db")
+
+POOL_MIN_SIZE = int(os.environ.get("POOL_MIN_SIZE", 4))
+POOL_MAX_SIZE = int(os.environ.get("POOL_MAX_SIZE", POOL_MIN_SIZE))
+# Seconds an unused connection above min_size is kept open.
+POOL_MAX_IDLE = float(os.environ.get("POOL_MAX_IDLE", 600))
+# Seconds after which a connection is replaced.
+POOL_MAX_LIFETIME = float(os.environ.get("POOL_MAX_LIFETIME", 3600))
+# Seconds a request may wait for a connection before failing.
+POOL_TIMEOUT = float(os.environ.get("POOL_TIMEOUT", 30))
+# Seconds to wait at startup for min_size connections; 0 skips the wait.
+POOL_WARMUP = float(os.environ.get("POOL_WARMUP", 10))
+
+checkout_wait = metrics.Histogram()
+
+
+def settings():
+    """Keyword arguments for ConnectionPool and AsyncConnectionPool."""
+
+    return {
+        "conninfo": DATABASE_URL,
+        "min_size": POOL_MIN_SIZE,
+        "max_size": max(POOL_MAX_SIZE, POOL_MIN_SIZE),
+        "max_idle": POOL_MAX_IDLE,
+        "max_lifetime": POOL_MAX_LIFETIME,
+        "timeout": POOL_TIMEOUT,
+    }
+
+
+class TimedConnectionPool(ConnectionPool):
+    """ConnectionPool that records how long each checkout waited."""
+
+    def getconn(self, timeout=None):
+        querylog.checkout()
+        start = time.perf_counter()
+        try:
+            return super().getconn(timeout)
+        finally:
+            checkout_wait.observe(time.perf_counter() - start)
+
+
+def warm_up(pool, log):
+    """Block until the pool holds min_size connections, or give up."""
+
+    if POOL_WARMUP <= 0:
+        return
+    try:
+        pool.wait(timeout=POOL_WARMUP)
+    except PoolTimeout:
+        log.warning(f"Pool not ready after {POOL_WARMUP}s, serving anyway.")
+
+
+def stats(pool):
+    """Pool counters plus the checkout wait-time histogram."""
+
+    data = pool.get_stats()
+    data["connections_in_use"] = data["pool_size"] - data["pool_available"]
+    data["checkout_wait_seconds"] = checkout_wait.snapshot()
+    return data
@@ -0,0 +1,84 @@
+"""Version-based ETags, so unchanged reads can be answered with 304.
+
+Listings are versioned by the per-table counters in row_count (see
+migrations/003_table_version.sql); single resources by the xmin of the rows
+they are built from. The version is always read before the data, so a
+response is never tagged with a version newer than its content.
+"""
+import hashlib
+
+from psycopg.rows import namedtuple_row
+
+# Everything order_status shows: its lines, their products and the payment.
+ORDER_VERSION = """
+    SELECT md5(concat_ws('|',
+        (
+            SELECT string_agg(c.xmin::text || ':' || p.xmin::text, ',' ORDER BY c.sku)
+            FROM contains c
+            JOIN product p USING (sku)
+            WHERE c.order_no = %(order_no)s
+        ),
+        (
+            SELECT 'paid ' || xmin::text
+            FROM pay
+            WHERE order_no = %(order_no)s AND cust_no = %(cust_no)s
+        )
+    )) AS version;
+"""
+
+# Everything customer_profile shows: the customer, and its orders and their
+# payments through the per-customer counter (migrations/013_orders_version.sql),
+# whose scope is the number as the database writes it, not as the URL does.
+PROFILE_VERSION = """
+    SELECT concat_ws('|',
+        (SELECT xmin::text FROM customer WHERE cust_no = %(cust_no)s),
+        (SELECT version::text FROM row_count WHERE tbl = 'orders' AND scope = %(cust_no)s::integer::text)
+    ) AS version;
+"""
+
+
+def make(*parts):
+    """An opaque tag for the given version parts."""
+
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:24]
+
+
+def tables(conn, names, *parts):
+    """A tag that changes whenever one of the tables ``names`` is written."""
+
+    with conn.cursor(row_factory=namedtuple_row) as cur:
+        versions = cur.execute(
+            """
+            SELECT tbl, version
+            FROM row_count
+            WHERE tbl = ANY(%(tables)s) AND scope = '';
+            """,
+            {"tables": list(names)},
+        ).fetchall()
+    return make(sorted(versions), *parts)
+
+
+def query(conn, sql, params, *parts):
+    """A tag built from the single version value ``sql`` returns."""
+
+    with conn.cursor(row_factory=namedtuple_row) as cur:
+        version = cur.execute(sql, params).fetchone().version
+    return make(version, *parts)
+
+
+def not_modified(etag, vary=None):
+    """The 304 answer for a request whose If-None-Match matched. ``vary``
+    names the request headers the tag depends on, as in the full answer."""
+
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+    if vary:
+        headers["Vary"] = vary
+    return "", 304, headers
+
+
+def tag(response, etag):
+    """Attach ``etag`` to a response and ask clients to revalidate it."""
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
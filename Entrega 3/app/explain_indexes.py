@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+"""Show which queries the index migrations move off sequential scans.
+
+For every index a migration creates, the queries of the app (and of the
+report) it is meant for are EXPLAINed twice: once as the database is, and
+once inside a transaction that drops the index and is then rolled back.
+
+    python explain_indexes.py [VERSION ...] [--url DATABASE_URL]
+
+The exit status is 1 if a query does not use its index. The planner
+prefers sequential scans on small tables, so run this on a realistic data
+set (see loader.py). Dropping an index locks its table until the rollback;
+use a development database.
+"""
+import argparse
+import collections
+import sys
+
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+
+from dbpool import DATABASE_URL
+
+# index: the index expected in the plan; query: the statement as the app
+# runs it; sample: a query returning its parameters from existing rows.
+Check = collections.namedtuple("Check", "index description query sample")
+
+CHECKS = {
+    "007_indexes": (
+        Check(
+            "pay_cust_no",
+            "confirm_delete_c: the payments of a customer",
+            "SELECT count(*) FROM pay WHERE cust_no = %(cust_no)s;",
+            "SELECT cust_no FROM pay LIMIT 1;",
+        ),
+        Check(
+            "contains_sku",
+            "confirm_delete_p: the order lines of a product",
+            "SELECT count(*) FROM contains WHERE sku = %(sku)s;",
+            "SELECT sku FROM contains LIMIT 1;",
+        ),
+        Check(
+            "process_order_no",
+            "confirm_delete_c: who processed a customer's orders",
+            """
+            SELECT count(*) FROM process
+            WHERE order_no IN (SELECT order_no FROM orders WHERE cust_no = %(cust_no)s);
+            """,
+            "SELECT cust_no FROM orders LIMIT 1;",
+        ),
+        Check(
+            "delivery_tin",
+            "confirm_delete_p: the deliveries of a product's suppliers",
+            """
+            SELECT count(*) FROM delivery
+            WHERE tin IN (SELECT tin FROM supplier WHERE sku = %(sku)s);
+            """,
+            "SELECT sku FROM supplier WHERE sku IS NOT NULL LIMIT 1;",
+        ),
+        Check(
+            "supplier_sku_date",
+            "supplier_edit: a page of a product's suppliers",
+            """
+            SELECT tin, name, address, sku, date FROM supplier
+            WHERE sku = %(sku)s AND (date, tin) > (%(date)s, %(tin)s)
+            ORDER BY date, tin LIMIT 11;
+            """,
+            "SELECT sku, date, tin FROM supplier WHERE sku IS NOT NULL LIMIT 1;",
+        ),
+        Check(
+            "product_price_sku",
+            "product_index / make_order: a page of the catalog",
+            """
+            SELECT sku, name, description, price FROM product
+            WHERE TRUE AND (price, sku) > (%(price)s, %(sku)s)
+            ORDER BY price, sku LIMIT 11;
+            """,
+            "SELECT price, sku FROM product ORDER BY price, sku LIMIT 1;",
+        ),
+        Check(
+            "product_name_pattern",
+            "report 6.2: sales of products whose name starts with A",
+            """
+            SELECT order_no, SUM(qty*price)
+            FROM contains
+            JOIN product USING (SKU)
+            WHERE name LIKE 'A%%'
+            GROUP BY order_no;
+            """,
+            "SELECT;",
+        ),
+        Check(
+            "orders_year",
+            "report 6.1: orders of 2023 with products over 50",
+            """
+            SELECT order_no
+            FROM orders
+            JOIN contains USING (order_no)
+            JOIN product USING (SKU)
+            WHERE price > 50 AND
+            EXTRACT(YEAR FROM date) = 2023;
+            """,
+            "SELECT;",
+        ),
+    ),
+    "008_product_search": (
+        Check(
+            "product_document",
+            "product_index / make_order: products matching the words searched",
+            """
+            SELECT sku, name, description, price FROM product
+            WHERE product_document(name, description) @@ to_tsquery('simple', %(words)s)
+               OR upper(sku) LIKE upper(%(prefix)s);
+            """,
+            """
+            SELECT (SELECT string_agg(format('%s:*', quote_literal(w)), ' & ')
+                    FROM unnest(tsvector_to_array(to_tsvector('simple', name))) AS w) AS words,
+                   '' AS prefix
+            FROM product WHERE to_tsvector('simple', name) <> '' LIMIT 1;
+            """,
+        ),
+        Check(
+            "product_sku_prefix",
+            "product_index / make_order: products whose SKU starts with the text searched",
+            """
+            SELECT sku, name, description, price FROM product
+            WHERE product_document(name, description) @@ to_tsquery('simple', %(words)s)
+               OR upper(sku) LIKE upper(%(prefix)s);
+            """,
+            "SELECT NULL AS words, sku || '%' AS prefix FROM product ORDER BY sku LIMIT 1;",
+        ),
+    ),
+    "011_order_history": (
+        Check(
+            "orders_cust_no_date",
+            "customer_profile: a page of a customer's orders, newest first",
+            """
+            SELECT order_no, date, item_count, order_total, paid FROM
+            (SELECT o.order_no, o.date, o.item_count, o.order_total,
+                    pay.order_no IS NOT NULL AS paid
+             FROM orders o
+             LEFT JOIN pay USING (order_no)
+             WHERE o.cust_no = %(cust_no)s) AS history
+            WHERE TRUE AND (date, order_no) < (%(date)s, %(order_no)s)
+            ORDER BY date DESC, order_no DESC LIMIT 21;
+            """,
+            """
+            SELECT cust_no, max(date) AS date, max(order_no) AS order_no
+            FROM orders GROUP BY cust_no ORDER BY count(*) DESC LIMIT 1;
+            """,
+        ),
+    ),
+}
+
+
+def scans(plan):
+    """The scan nodes of an EXPLAIN (FORMAT JSON) plan, as text."""
+
+    found = []
+    if "Scan" in plan["Node Type"]:
+        text = plan["Node Type"]
+        if "Index Name" in plan:
+            text += f" using {plan['Index Name']}"
+        if "Relation Name" in plan:
+            text += f" on {plan['Relation Name']}"
+        found.append(text)
+    for child in plan.get("Plans", ()):
+        found += scans(child)
+    return found
+
+
+def explain(conn, check, params):
+    plan = conn.execute(
+        sql.SQL("EXPLAIN (FORMAT JSON) {}").format(sql.SQL(check.query)), params
+    ).fetchone()["QUERY PLAN"]
+    return scans(plan[0]["Plan"])
+
+
+def verify(conn, check):
+    """The scans of the query of ``check`` without and with its index."""
+
+    params = conn.execute(check.sample).fetchone()
+    if params is None:
+        return None
+    with conn.transaction(force_rollback=True):
+        conn.execute(sql.SQL("DROP INDEX {};").format(sql.Identifier(check.index)))
+        before = explain(conn, check, params)
+    return before, explain(conn, check, params)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("versions", nargs="*", default=list(CHECKS))
+    parser.add_argument("--url", default=DATABASE_URL)
+    args = parser.parse_args(argv)
+
+    unused = 0
+    with psycopg.connect(args.url, autocommit=True, row_factory=dict_row) as conn:
+        for version in args.versions:
+            for check in CHECKS[version]:
+                print(f"{version} {check.index}: {check.description}")
+                result = verify(conn, check)
+                if result is None:
+                    print("  skipped: no rows to take parameters from")
+                    continue
+                before, after = result
+                used = any(check.index in scan.split() for scan in after)
+                unused += not used
+                print(f"  before: {', '.join(before)}")
+                print(f"  after:  {', '.join(after)}")
+                print(f"  uses {check.index}: {'yes' if used else 'NO'}")
+    return 1 if unused else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
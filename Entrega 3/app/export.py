@@ -0,0 +1,111 @@
+"""Streaming exports of whole tables, for the nightly warehouse sync.
+
+CSV is produced by ``COPY ... TO STDOUT`` and NDJSON by a server-side
+(named) cursor read in batches, so a worker holds at most one batch in
+memory however large the table is. Rows come out in key order and can be
+restricted to keys after ``after`` and, for orders and their lines, to
+order dates in [since, until).
+"""
+import datetime
+import os
+
+from psycopg import sql
+
+# Rows fetched from the server-side cursor per chunk of NDJSON.
+BATCH = int(os.environ.get("EXPORT_BATCH", 1000))
+
+# Export name: (table, key columns, whether rows have an order date).
+TABLES = {
+    "customers": ("customer", ("cust_no",), False),
+    "products": ("product", ("sku",), False),
+    "orders": ("orders", ("order_no",), True),
+    "contains": ("contains", ("order_no", "sku"), True),
+}
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def filters(name, args):
+    """The filters of export ``name`` given in the query string ``args``.
+
+    Raises ValueError for values the export cannot use, so that the request
+    fails before the response starts rather than halfway through it.
+    """
+
+    table, keys, dated = TABLES[name]
+    after = args.get("after")
+    if after is not None and keys[0] != "sku":
+        after = int(after)
+    since, until = args.get("since"), args.get("until")
+    if (since or until) and not dated:
+        raise ValueError(f"{name} cannot be filtered by date")
+    return {
+        "after": after,
+        "since": datetime.date.fromisoformat(since) if since else None,
+        "until": datetime.date.fromisoformat(until) if until else None,
+    }
+
+
+def query(name, after=None, since=None, until=None):
+    """The SELECT of export ``name`` and its parameters."""
+
+    table, keys, dated = TABLES[name]
+    conditions = []
+    if after is not None:
+        conditions.append(sql.SQL("{} > %(after)s").format(sql.Identifier(keys[0])))
+    if dated and (since is not None or until is not None):
+        dates = sql.SQL(
+            "date >= coalesce(%(since)s::date, '-infinity')"
+            " AND date < coalesce(%(until)s::date, 'infinity')"
+        )
+        if table != "orders":
+            dates = sql.SQL(
+                "order_no IN (SELECT order_no FROM orders WHERE {})"
+            ).format(dates)
+        conditions.append(dates)
+
+    where = sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("TRUE")
+    select = sql.SQL("SELECT * FROM {} WHERE {} ORDER BY {}").format(
+        sql.Identifier(table),
+        where,
+        sql.SQL(", ").join(map(sql.Identifier, keys)),
+    )
+    return select, {"after": after, "since": since, "until": until}
+
+
+def _csv(conn, select, params):
+    statement = sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)").format(
+        select
+    )
+    with conn.cursor() as cur:
+        with cur.copy(statement, params) as copy:
+            for data in copy:
+                yield bytes(data)
+
+
+def _ndjson(conn, select, params):
+    # Postgres writes the JSON itself, so dates and numerics need no encoder.
+    rows = sql.SQL("SELECT row_to_json(t)::text FROM ({}) t").format(select)
+    with conn.cursor(name="export") as cur:
+        cur.itersize = BATCH
+        cur.execute(rows, params)
+        while batch := cur.fetchmany(BATCH):
+            yield "".join(row[0] + "\n" for row in batch).encode()
+
+
+def stream(pool, name, fmt, **filters):
+    """Yield export ``name`` in ``fmt`` chunk by chunk.
+
+    The connection is taken from ``pool`` when the first chunk is asked for
+    and given back once the last one was sent.
+    """
+
+    select, params = query(name, **filters)
+    with pool.connection() as conn:
+        if fmt == "csv":
+            yield from _csv(conn, select, params)
+        else:
+            yield from _ndjson(conn, select, params)
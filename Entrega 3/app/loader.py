@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+"""Fast loading of large data sets with COPY.
+
+The indexes and key constraints of the tables being loaded, and the foreign
+keys that point at them, are dropped first and rebuilt once all the rows
+are in, which is much faster than maintaining them row by row. Everything
+runs in one transaction, so a failed load (a duplicate key, a broken
+reference, an order without lines) leaves the database as it was.
+
+    python loader.py load customer=customers.csv orders=orders.csv ...
+    python loader.py generate --customers 100000 --orders 500000
+    python loader.py generate --customers 1000 --out data/
+
+The CSV files of ``load`` start with a header line naming their columns.
+``generate`` loads a data set from datagen.py, numbering customers and
+orders after the ones already in the database, or writes it as CSV files.
+"""
+import argparse
+import contextlib
+import csv
+import pathlib
+import sys
+import time
+
+import psycopg
+from psycopg import sql
+from psycopg.rows import namedtuple_row
+
+import datagen
+from dbpool import DATABASE_URL
+
+# Bytes handed to COPY at a time.
+CHUNK = 64 * 1024
+
+
+@contextlib.contextmanager
+def without_indexes(conn, tables):
+    """Drop the indexes and constraints that slow down loading ``tables``
+    and rebuild them when the block exits."""
+
+    with conn.cursor(row_factory=namedtuple_row) as cur:
+        constraints = cur.execute(
+            """
+            SELECT conrelid::regclass::text AS tbl, confrelid::regclass::text AS ref,
+                   conname AS name, pg_get_constraintdef(oid) AS definition
+            FROM pg_constraint
+            WHERE (contype IN ('p', 'u') AND conrelid = ANY(%(tables)s::regclass[]))
+               OR (contype = 'f' AND (conrelid = ANY(%(tables)s::regclass[])
+                                      OR confrelid = ANY(%(tables)s::regclass[])))
+            -- Foreign keys first, as they need the keys they point at.
+            ORDER BY contype = 'f' DESC, conname;
+            """,
+            {"tables": list(tables)},
+        ).fetchall()
+        indexes = cur.execute(
+            """
+            SELECT indrelid::regclass::text AS tbl, NULL AS ref,
+                   indexrelid::regclass::text AS name, pg_get_indexdef(indexrelid) AS definition
+            FROM pg_index i
+            WHERE indrelid = ANY(%(tables)s::regclass[])
+            AND NOT EXISTS (
+                SELECT 1 FROM pg_constraint c
+                WHERE c.conindid = i.indexrelid AND c.contype <> 'f'
+            );
+            """,
+            {"tables": list(tables)},
+        ).fetchall()
+        deferred = {
+            row.tbl
+            for row in cur.execute(
+                """
+                SELECT DISTINCT tgrelid::regclass::text AS tbl
+                FROM pg_trigger
+                WHERE tgdeferrable AND NOT tgisinternal
+                AND tgrelid = ANY(%(tables)s::regclass[]);
+                """,
+                {"tables": list(tables)},
+            )
+        }
+
+        for c in constraints:
+            cur.execute(
+                sql.SQL("ALTER TABLE {} DROP CONSTRAINT {};").format(
+                    sql.SQL(c.tbl), sql.Identifier(c.name)
+                )
+            )
+        for index in indexes:
+            cur.execute(sql.SQL("DROP INDEX {};").format(sql.SQL(index.name)))
+
+        yield
+
+        # Keys before the foreign keys that need them, then the indexes.
+        rebuilds = [
+            sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {};").format(
+                sql.SQL(c.tbl), sql.Identifier(c.name), sql.SQL(c.definition)
+            )
+            for c in reversed(constraints)
+        ] + [sql.SQL(index.definition) for index in indexes]
+        # A table with deferred checks of new rows pending (orders, with
+        # check_order) cannot be altered, and the checks want the indexes of
+        # the other tables: rebuild those, run the checks, then the rest.
+        touched = [{c.tbl, c.ref} for c in reversed(constraints)] + [{i.tbl} for i in indexes]
+        for statement, tbls in zip(rebuilds, touched):
+            if not tbls & deferred:
+                cur.execute(statement)
+        if deferred:
+            cur.execute("SET CONSTRAINTS ALL IMMEDIATE;")
+        for statement, tbls in zip(rebuilds, touched):
+            if tbls & deferred:
+                cur.execute(statement)
+
+
+def copy_rows(conn, table, columns, rows):
+    """COPY the tuples ``rows`` into ``table`` and return how many there were."""
+
+    n = 0
+    statement = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+    with conn.cursor() as cur, cur.copy(statement) as copy:
+        for row in rows:
+            copy.write_row(row)
+            n += 1
+    return n
+
+
+def copy_file(conn, table, source):
+    """COPY the CSV file ``source``, header line first, into ``table``."""
+
+    columns = next(csv.reader([source.readline().decode("utf-8-sig")]))
+    statement = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+        sql.Identifier(table),
+        sql.SQL(", ").join(sql.Identifier(c.strip().lower()) for c in columns),
+    )
+    with conn.cursor() as cur:
+        with cur.copy(statement) as copy:
+            while data := source.read(CHUNK):
+                copy.write(data)
+        return cur.rowcount
+
+
+def load(conn, sources, log=print):
+    """Load ``sources``, pairs of a table and a callable that COPYs its rows
+    and returns their number, in one transaction with indexes rebuilt once."""
+
+    tables = [table for table, _ in sources]
+    with conn.transaction():
+        # Nobody else may see, or write to, the tables while they lack keys.
+        conn.execute(
+            sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE;").format(
+                sql.SQL(", ").join(map(sql.Identifier, tables))
+            )
+        )
+        # contains_unit_price would look up the price of every line without
+        # the key of product; lines loaded without one are priced below.
+        if "contains" in tables:
+            conn.execute("ALTER TABLE contains DISABLE TRIGGER contains_unit_price;")
+        with without_indexes(conn, tables):
+            for table, copy in sources:
+                started = time.perf_counter()
+                n = copy()
+                log(f"{table}: {n} rows in {time.perf_counter() - started:.1f}s")
+            started = time.perf_counter()
+        log(f"indexes and constraints rebuilt in {time.perf_counter() - started:.1f}s")
+
+        if "contains" in tables:
+            # Orders still without totals are left to backfill.py.
+            started = time.perf_counter()
+            n = conn.execute(
+                """
+                UPDATE contains c SET unit_price = p.price
+                FROM product p, orders o
+                WHERE c.sku = p.sku AND o.order_no = c.order_no
+                AND c.unit_price IS NULL AND o.order_total IS NOT NULL;
+                """
+            ).rowcount
+            conn.execute("ALTER TABLE contains ENABLE TRIGGER contains_unit_price;")
+            log(f"contains: {n} lines priced in {time.perf_counter() - started:.1f}s")
+
+        # Explicit numbers do not move the identity sequences.
+        if "customer" in tables:
+            conn.execute(
+                "SELECT setval(pg_get_serial_sequence('customer', 'cust_no'), coalesce(max(cust_no), 0) + 1, false) FROM customer;"
+            )
+        if "orders" in tables:
+            conn.execute(
+                "SELECT setval(pg_get_serial_sequence('orders', 'order_no'), coalesce(max(order_no), 0) + 1, false) FROM orders;"
+            )
+    for table in tables:
+        conn.execute(sql.SQL("ANALYZE {};").format(sql.Identifier(table)))
+
+
+def generator(conn, args):
+    """The datagen.Generator asked for on the command line."""
+
+    first_customer, first_order = conn.execute(
+        """
+        SELECT (SELECT coalesce(max(cust_no), 0) + 1 FROM customer),
+               (SELECT coalesce(max(order_no), 0) + 1 FROM orders);
+        """
+    ).fetchone()
+    return datagen.Generator(
+        seed=args.seed,
+        customers=args.customers,
+        orders=args.orders,
+        products=args.products,
+        employees=args.employees,
+        first_customer=first_customer,
+        first_order=first_order,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=DATABASE_URL)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load_command = commands.add_parser("load", help="load CSV files")
+    load_command.add_argument("files", nargs="+", metavar="TABLE=FILE")
+
+    generate = commands.add_parser("generate", help="load or write a synthetic data set")
+    generate.add_argument("--seed", type=int, default=1)
+    generate.add_argument("--customers", type=int, default=1000)
+    generate.add_argument("--orders", type=int, default=5000)
+    generate.add_argument("--products", type=int, default=500)
+    generate.add_argument("--employees", type=int, default=50)
+    generate.add_argument("--out", type=pathlib.Path, help="write CSV files here instead")
+    args = parser.parse_args(argv)
+
+    with psycopg.connect(args.url, autocommit=True) as conn, contextlib.ExitStack() as files:
+        if args.command == "load":
+            sources = []
+            for pair in args.files:
+                table, _, path = pair.partition("=")
+                source = files.enter_context(open(path, "rb"))
+                sources.append((table, lambda table=table, source=source: copy_file(conn, table, source)))
+            load(conn, sources)
+            return
+
+        data = generator(conn, args)
+        if args.out is not None:
+            args.out.mkdir(parents=True, exist_ok=True)
+            for table in datagen.TABLES:
+                with open(args.out / f"{table}.csv", "w", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(datagen.COLUMNS[table])
+                    writer.writerows(data.rows(table))
+            return
+
+        load(
+            conn,
+            [
+                (table, lambda table=table: copy_rows(conn, table, datagen.COLUMNS[table], data.rows(table)))
+                for table in datagen.TABLES
+            ],
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""In-process metrics shared by the request handlers.
+
+Statement and request timings are kept as labelled histograms and exported
+in the Prometheus text format by the /metrics route.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+import psycopg
+from flask import has_request_context
+from flask import request
+from psycopg import sql
+
+import querylog
+
+# Upper bounds, in seconds, of the histogram buckets.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Statements are labelled by their first characters, whitespace collapsed.
+STATEMENT_LABEL_LENGTH = 80
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets.
+
+    Safe to update from several threads at once.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """Return the cumulative bucket counts, the count and the sum."""
+
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative, running = {}, 0
+        for bound, n in zip(self.buckets + ("+Inf",), counts):
+            running += n
+            cumulative[str(bound)] = running
+        return {"buckets": cumulative, "count": running, "sum": total}
+
+
+class Family:
+    """A named metric with one child per combination of label values."""
+
+    def __init__(self, name, help, labels, kind="histogram"):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.kind = kind
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        if self.kind == "counter":
+            with self._lock:
+                self._children[labels] = self._children.get(labels, 0) + value
+            return
+        child = self._children.get(labels)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labels, Histogram())
+        child.observe(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            label = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, values))
+            if self.kind == "counter":
+                lines.append(f"{self.name}{{{label}}} {child}")
+                continue
+            snap = child.snapshot()
+            sep = "," if label else ""
+            for bound, n in snap["buckets"].items():
+                lines.append(f'{self.name}_bucket{{{label}{sep}le="{bound}"}} {n}')
+            lines.append(f"{self.name}_sum{{{label}}} {snap['sum']}")
+            lines.append(f"{self.name}_count{{{label}}} {snap['count']}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REGISTRY = []
+
+
+def family(name, help, labels, kind="histogram"):
+    """Create a metric and register it for export."""
+
+    metric = Family(name, help, labels, kind)
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    """All the registered metrics in the Prometheus text format."""
+
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+sql_duration = family(
+    "sql_statement_duration_seconds",
+    "Time spent executing each SQL statement.",
+    ("route", "statement"),
+)
+sql_rows = family(
+    "sql_statement_rows_total",
+    "Rows returned or affected by each SQL statement.",
+    ("route", "statement"),
+    kind="counter",
+)
+request_duration = family(
+    "http_request_duration_seconds",
+    "Time spent handling each request.",
+    ("route", "method", "status"),
+)
+
+_labels = {}
+
+# The endpoint of requests served outside of Flask (the Quart app of asgi.py).
+_route = contextvars.ContextVar("metrics_route", default="-")
+
+
+def route():
+    """The endpoint of the current request, or "-" outside of one."""
+
+    if has_request_context():
+        return request.endpoint or "unmatched"
+    return _route.get()
+
+
+def set_route(endpoint):
+    """Label what the current context runs next with ``endpoint``, for
+    requests that are not served by Flask."""
+
+    _route.set(endpoint or "unmatched")
+
+
+def statement(cur, query):
+    """``query`` as text with its whitespace collapsed."""
+
+    if isinstance(query, sql.Composable):
+        query = query.as_string(cur)
+    elif isinstance(query, bytes):
+        query = query.decode()
+    text = _labels.get(query)
+    if text is None:
+        text = " ".join(query.split())
+        if len(_labels) < 1000:
+            _labels[query] = text
+    return text
+
+
+class _Timed:
+    def _record(self, query, elapsed):
+        text = statement(self, query)
+        querylog.record(text)
+        labels = (route(), text[:STATEMENT_LABEL_LENGTH])
+        sql_duration.observe(elapsed, *labels)
+        if self.rowcount > 0:
+            sql_rows.observe(self.rowcount, *labels)
+
+
+class TimedCursor(_Timed, psycopg.Cursor):
+    """Cursor that records the latency and row count of every statement."""
+
+    def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            self._record(query, time.perf_counter() - start)
+
+    def executemany(self, query, params_seq, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, params_seq, **kwargs)
+        finally:
+            self._record(query, time.perf_counter() - start)
+
+
+class AsyncTimedCursor(_Timed, psycopg.AsyncCursor):
+    """TimedCursor for async connections."""
+
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            self._record(query, time.perf_counter() - start)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().executemany(query, params_seq, **kwargs)
+        finally:
+            self._record(query, time.perf_counter() - start)
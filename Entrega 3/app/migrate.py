@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+"""Apply the SQL files in migrations/ that the database has not seen yet.
+
+Every file runs in its own transaction and is recorded in the
+schema_migrations table, so running this script again is harmless. The
+connection is expected to be in autocommit mode.
+
+A file whose first line is ``-- migrate: no-transaction`` runs outside a
+transaction instead, one ``;``-terminated line at a time, for statements
+such as CREATE INDEX CONCURRENTLY. Its statements should be safe to run
+again (IF NOT EXISTS), as a failure part way leaves the earlier ones done.
+"""
+import pathlib
+import sys
+
+import psycopg
+
+from dbpool import DATABASE_URL
+
+MIGRATIONS = pathlib.Path(__file__).parent / "migrations"
+
+NO_TRANSACTION = "-- migrate: no-transaction"
+
+
+def applied(conn):
+    """Return the versions that were already applied."""
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations(
+        version VARCHAR(255) PRIMARY KEY,
+        applied_at TIMESTAMP NOT NULL DEFAULT now()
+        );
+        """
+    )
+    return {row[0] for row in conn.execute("SELECT version FROM schema_migrations;")}
+
+
+def statements(text):
+    """Split ``text`` after every line that ends with a semicolon."""
+
+    statement = []
+    for line in text.splitlines(keepends=True):
+        statement.append(line)
+        if line.rstrip().endswith(";"):
+            yield "".join(statement)
+            statement = []
+    if "".join(statement).strip():
+        yield "".join(statement)
+
+
+def migrate(conn):
+    """Apply the pending migrations in order and yield their versions."""
+
+    done = applied(conn)
+    for path in sorted(MIGRATIONS.glob("*.sql")):
+        version = path.stem
+        if version in done:
+            continue
+        text = path.read_text()
+        if text.startswith(NO_TRANSACTION):
+            for statement in statements(text):
+                conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_migrations(version) VALUES (%(version)s);",
+                {"version": version},
+            )
+        else:
+            with conn.transaction():
+                conn.execute(text)
+                conn.execute(
+                    "INSERT INTO schema_migrations(version) VALUES (%(version)s);",
+                    {"version": version},
+                )
+        yield version
+
+
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else DATABASE_URL
+    with psycopg.connect(url, autocommit=True) as conn:
+        for version in migrate(conn):
+            print(f"applied {version}")
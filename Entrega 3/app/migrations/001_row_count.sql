@@ -0,0 +1,100 @@
+-- Row counters kept up to date by triggers, so the listing routes can draw
+-- their pagination without a `count(*)` over the whole table.
+
+CREATE TABLE IF NOT EXISTS row_count(
+tbl VARCHAR(63) NOT NULL,
+scope VARCHAR(25) NOT NULL DEFAULT '',
+total BIGINT NOT NULL,
+PRIMARY KEY (tbl, scope)
+);
+
+create or replace function count_rows()
+    returns trigger
+as
+$$
+declare
+    n bigint;
+begin
+    if TG_OP = 'INSERT' then
+        select count(*) into n from inserted;
+    else
+        select -count(*) into n from deleted;
+    end if;
+
+    if n <> 0 then
+        insert into row_count(tbl, total) values (TG_TABLE_NAME, n)
+        on conflict (tbl, scope) do update set total = row_count.total + excluded.total;
+    end if;
+
+    return null;
+end
+$$
+language plpgsql;
+
+-- Suppliers are only ever listed per product, so they are counted per SKU.
+create or replace function count_supplier_rows()
+    returns trigger
+as
+$$
+begin
+    if TG_OP in ('DELETE', 'UPDATE') then
+        update row_count r set total = r.total - d.n
+        from (select sku, count(*) as n from deleted where sku is not null group by sku) d
+        where r.tbl = 'supplier' and r.scope = d.sku;
+    end if;
+
+    if TG_OP in ('INSERT', 'UPDATE') then
+        insert into row_count(tbl, scope, total)
+        select 'supplier', sku, count(*) from inserted where sku is not null group by sku
+        on conflict (tbl, scope) do update set total = row_count.total + excluded.total;
+    end if;
+
+    return null;
+end
+$$
+language plpgsql;
+
+create or replace trigger customer_count_insert
+after insert on customer
+referencing new table as inserted
+for each statement execute function count_rows();
+
+create or replace trigger customer_count_delete
+after delete on customer
+referencing old table as deleted
+for each statement execute function count_rows();
+
+create or replace trigger product_count_insert
+after insert on product
+referencing new table as inserted
+for each statement execute function count_rows();
+
+create or replace trigger product_count_delete
+after delete on product
+referencing old table as deleted
+for each statement execute function count_rows();
+
+create or replace trigger supplier_count_insert
+after insert on supplier
+referencing new table as inserted
+for each statement execute function count_supplier_rows();
+
+create or replace trigger supplier_count_update
+after update on supplier
+referencing old table as deleted new table as inserted
+for each statement execute function count_supplier_rows();
+
+create or replace trigger supplier_count_delete
+after delete on supplier
+referencing old table as deleted
+for each statement execute function count_supplier_rows();
+
+-- Seed the counters while writers are kept out.
+LOCK TABLE customer, product, supplier IN SHARE MODE;
+
+DELETE FROM row_count WHERE tbl IN ('customer', 'product', 'supplier');
+
+INSERT INTO row_count(tbl, total) SELECT 'customer', count(*) FROM customer;
+INSERT INTO row_count(tbl, total) SELECT 'product', count(*) FROM product;
+INSERT INTO row_count(tbl, scope, total)
+SELECT 'supplier', sku, count(*) FROM supplier WHERE sku IS NOT NULL GROUP BY sku;
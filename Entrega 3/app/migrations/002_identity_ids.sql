@@ -0,0 +1,11 @@
+-- Hand out customer and order numbers from sequences instead of max()+1.
+-- The columns stay GENERATED BY DEFAULT so explicit numbers still work.
+
+ALTER TABLE customer ALTER COLUMN cust_no ADD GENERATED BY DEFAULT AS IDENTITY;
+ALTER TABLE orders ALTER COLUMN order_no ADD GENERATED BY DEFAULT AS IDENTITY;
+
+-- The ALTERs above keep both tables locked, so the maxima cannot move.
+SELECT setval(pg_get_serial_sequence('customer', 'cust_no'), coalesce(max(cust_no), 0) + 1, false)
+FROM customer;
+SELECT setval(pg_get_serial_sequence('orders', 'order_no'), coalesce(max(order_no), 0) + 1, false)
+FROM orders;
@@ -0,0 +1,42 @@
+-- Give every counted table a version that changes with each statement that
+-- writes to it, so readers can tell cheaply whether a listing changed.
+
+ALTER TABLE row_count ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+
+create or replace function count_rows()
+    returns trigger
+as
+$$
+declare
+    n bigint;
+begin
+    if TG_OP = 'INSERT' then
+        select count(*) into n from inserted;
+    elsif TG_OP = 'DELETE' then
+        select -count(*) into n from deleted;
+    elsif exists(select from inserted) then
+        n := 0;
+    else
+        return null;
+    end if;
+
+    if n <> 0 or TG_OP = 'UPDATE' then
+        insert into row_count(tbl, total, version) values (TG_TABLE_NAME, n, 1)
+        on conflict (tbl, scope) do update
+        set total = row_count.total + excluded.total, version = row_count.version + 1;
+    end if;
+
+    return null;
+end
+$$
+language plpgsql;
+
+create or replace trigger customer_count_update
+after update on customer
+referencing old table as deleted new table as inserted
+for each statement execute function count_rows();
+
+create or replace trigger product_count_update
+after update on product
+referencing old table as deleted new table as inserted
+for each statement execute function count_rows();
@@ -0,0 +1,46 @@
+-- A permanent date dimension for the OLAP queries, which used to drop,
+-- recreate and refill a dateD table each time they ran. It covers
+-- 2020-2035 and every order date; calendar_extend() adds more years.
+
+CREATE TABLE IF NOT EXISTS calendar(
+date DATE PRIMARY KEY,
+year INTEGER NOT NULL,
+quarter INTEGER NOT NULL,
+month INTEGER NOT NULL,
+day INTEGER NOT NULL,
+weekday VARCHAR(9) NOT NULL,
+-- Sunday is 1 and Saturday 7, the order the report lists weekdays in.
+weekday_order INTEGER NOT NULL,
+iso_year INTEGER NOT NULL,
+iso_week INTEGER NOT NULL,
+UNIQUE (year, month, day)
+);
+
+CREATE INDEX IF NOT EXISTS calendar_iso_week ON calendar (iso_year, iso_week);
+
+-- Add the days from first to last that are missing; returns how many.
+create or replace function calendar_extend(first date, last date)
+    returns integer
+as
+$$
+declare
+    n integer;
+begin
+    insert into calendar
+    select dd, extract(year from dd), extract(quarter from dd), extract(month from dd),
+           extract(day from dd), trim(to_char(dd, 'Day')), extract(dow from dd) + 1,
+           extract(isoyear from dd), extract(week from dd)
+    from generate_series(first, last, '1 day'::interval) as g(ts),
+         lateral (select ts::date as dd) d
+    on conflict (date) do nothing;
+
+    get diagnostics n = row_count;
+    return n;
+end
+$$
+language plpgsql;
+
+SELECT calendar_extend(least('2020-01-01', (SELECT min(date) FROM orders)),
+                       greatest('2035-12-31', (SELECT max(date) FROM orders)));
+
+ANALYZE calendar;
@@ -0,0 +1,25 @@
+-- Version product_sales in row_count like the listed tables, so the cached
+-- analytics can tell whether a sale was added, changed or removed since
+-- they were computed. The triggers of product_sales fire for the changes
+-- its own maintenance triggers make.
+
+create or replace trigger product_sales_count_insert
+after insert on product_sales
+referencing new table as inserted
+for each statement execute function count_rows();
+
+create or replace trigger product_sales_count_update
+after update on product_sales
+referencing old table as deleted new table as inserted
+for each statement execute function count_rows();
+
+create or replace trigger product_sales_count_delete
+after delete on product_sales
+referencing old table as deleted
+for each statement execute function count_rows();
+
+LOCK TABLE product_sales IN SHARE MODE;
+
+DELETE FROM row_count WHERE tbl = 'product_sales';
+
+INSERT INTO row_count(tbl, total) SELECT 'product_sales', count(*) FROM product_sales;
@@ -0,0 +1,32 @@
+-- migrate: no-transaction
+-- Indexes for the access paths of the app and of section 6 of the report,
+-- built without blocking writes. Check them with explain_indexes.py.
+
+-- Foreign keys the app looks rows up by: a customer's orders and payments
+-- (profile, delete preview, delete), a product's order lines, the orders
+-- an employee processed, and a supplier's deliveries.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_cust_no ON orders (cust_no);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS pay_cust_no ON pay (cust_no);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS contains_sku ON contains (sku);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS process_order_no ON process (order_no);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS delivery_tin ON delivery (tin);
+
+-- A product's suppliers, in the order supplier_edit pages through them.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS supplier_sku_date ON supplier (sku, date, tin);
+
+-- The catalog is paged by (price, sku); also price ranges (6.1).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_price_sku ON product (price, sku);
+
+-- Name prefixes, `name LIKE 'A%'` (6.2), whatever the collation.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_name_pattern ON product (name text_pattern_ops);
+
+-- Orders of a year, `EXTRACT(YEAR FROM date) = 2023` (6.1).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_year ON orders ((EXTRACT(YEAR FROM date)));
+
+ANALYZE orders;
+ANALYZE pay;
+ANALYZE contains;
+ANALYZE process;
+ANALYZE delivery;
+ANALYZE supplier;
+ANALYZE product;
@@ -0,0 +1,21 @@
+-- migrate: no-transaction
+-- Product search (search.py): words of the name and description through a
+-- full-text index, SKUs by prefix. Check them with explain_indexes.py.
+
+-- The searchable text of a product; names weigh more than descriptions.
+-- The 'simple' configuration does not stem, as the catalog mixes languages.
+create or replace function product_document(name varchar, description varchar)
+    returns tsvector
+as
+$$
+    select setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+$$
+language sql immutable parallel safe;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_document ON product USING gin (product_document(name, description));
+
+-- SKUs as typed, in any case: `upper(sku) LIKE 'FJ93%'`.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_sku_prefix ON product (upper(sku) text_pattern_ops);
+
+ANALYZE product;
@@ -0,0 +1,13 @@
+-- Shopping carts kept in the database instead of the session cookie, one
+-- per customer, so they survive across requests and workers (carts.py).
+-- They go away with their customer or product.
+
+CREATE TABLE IF NOT EXISTS cart_item(
+cust_no INTEGER REFERENCES customer ON DELETE CASCADE,
+SKU VARCHAR(25) REFERENCES product ON DELETE CASCADE,
+qty INTEGER NOT NULL CHECK (qty > 0),
+added TIMESTAMP NOT NULL DEFAULT now(),
+PRIMARY KEY (cust_no, SKU)
+);
+
+CREATE INDEX IF NOT EXISTS cart_item_sku ON cart_item (sku);
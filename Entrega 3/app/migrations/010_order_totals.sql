@@ -0,0 +1,165 @@
+-- Order totals kept on orders, so listings and spend aggregates read one
+-- table instead of joining contains and product over all history.
+--
+-- contains.unit_price is the price of the product when the line was added;
+-- a line inserted without one takes the current price. It is not named
+-- price so that the report's joins of contains and product stay valid.
+-- orders.order_total (sum of qty * unit_price) and orders.item_count (sum
+-- of qty) follow every change to contains. Existing rows are NULL until
+-- backfill.py has filled them; the triggers leave NULL totals alone.
+
+ALTER TABLE contains ADD COLUMN IF NOT EXISTS unit_price NUMERIC(10, 2);
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS order_total NUMERIC(12, 2);
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS item_count INTEGER;
+
+-- Only new orders start from zero.
+ALTER TABLE orders ALTER COLUMN order_total SET DEFAULT 0;
+ALTER TABLE orders ALTER COLUMN item_count SET DEFAULT 0;
+
+create or replace function contains_unit_price()
+    returns trigger
+as
+$$
+begin
+    if new.unit_price is null then
+        select price into new.unit_price from product where sku = new.sku;
+    end if;
+
+    return new;
+end
+$$
+language plpgsql;
+
+create or replace trigger contains_unit_price
+before insert on contains
+for each row execute function contains_unit_price();
+
+-- Add what the statement inserted and take away what it deleted.
+create or replace function order_totals_sync()
+    returns trigger
+as
+$$
+begin
+    if TG_OP = 'INSERT' then
+        update orders o set order_total = o.order_total + d.total, item_count = o.item_count + d.items
+        from (
+            select order_no, coalesce(sum(qty * unit_price), 0) as total, coalesce(sum(qty), 0) as items
+            from inserted
+            group by order_no
+        ) d
+        where o.order_no = d.order_no;
+    elsif TG_OP = 'DELETE' then
+        update orders o set order_total = o.order_total - d.total, item_count = o.item_count - d.items
+        from (
+            select order_no, coalesce(sum(qty * unit_price), 0) as total, coalesce(sum(qty), 0) as items
+            from deleted
+            group by order_no
+        ) d
+        where o.order_no = d.order_no;
+    else
+        update orders o set order_total = o.order_total + d.total, item_count = o.item_count + d.items
+        from (
+            select order_no, coalesce(sum(qty * unit_price), 0) as total, coalesce(sum(qty), 0) as items
+            from (
+                select order_no, qty, unit_price from inserted
+                union all
+                select order_no, -qty, unit_price from deleted
+            ) t
+            group by order_no
+        ) d
+        where o.order_no = d.order_no and (d.total <> 0 or d.items <> 0);
+    end if;
+
+    return null;
+end
+$$
+language plpgsql;
+
+create or replace trigger contains_totals_insert
+after insert on contains
+referencing new table as inserted
+for each statement execute function order_totals_sync();
+
+create or replace trigger contains_totals_update
+after update on contains
+referencing old table as deleted new table as inserted
+for each statement execute function order_totals_sync();
+
+create or replace trigger contains_totals_delete
+after delete on contains
+referencing old table as deleted
+for each statement execute function order_totals_sync();
+
+-- Fill the totals of the orders numbered first to last that have none,
+-- pricing their lines at the current price. Returns how many were filled.
+create or replace function order_totals_backfill(first integer, last integer)
+    returns integer
+as
+$$
+declare
+    n integer;
+begin
+    update contains c set unit_price = p.price
+    from product p
+    where c.sku = p.sku and c.unit_price is null and c.order_no between first and last;
+
+    update orders o set order_total = t.total, item_count = t.items
+    from (
+        select o.order_no, coalesce(sum(c.qty * c.unit_price), 0) as total, coalesce(sum(c.qty), 0) as items
+        from orders o
+        left join contains c using (order_no)
+        where o.order_no between first and last and o.order_total is null
+        group by o.order_no
+    ) t
+    where o.order_no = t.order_no and o.order_total is null;
+
+    get diagnostics n = row_count;
+    return n;
+end
+$$
+language plpgsql;
+
+-- product_sales does not depend on prices or totals; rebuild only the
+-- orders whose number, customer or date, or whose lines, changed.
+create or replace function product_sales_sync()
+    returns trigger
+as
+$$
+declare
+    changed integer[];
+begin
+    if TG_OP = 'INSERT' then
+        select array_agg(distinct order_no) into changed from inserted;
+    elsif TG_OP = 'DELETE' then
+        select array_agg(distinct order_no) into changed from deleted;
+    elsif TG_TABLE_NAME = 'orders' then
+        select array_agg(distinct order_no) into changed
+        from (
+            (select order_no, cust_no, date from inserted
+             except select order_no, cust_no, date from deleted)
+            union all
+            (select order_no, cust_no, date from deleted
+             except select order_no, cust_no, date from inserted)
+        ) t;
+    elsif TG_TABLE_NAME = 'contains' then
+        select array_agg(distinct order_no) into changed
+        from (
+            (select order_no, sku, qty from inserted
+             except select order_no, sku, qty from deleted)
+            union all
+            (select order_no, sku, qty from deleted
+             except select order_no, sku, qty from inserted)
+        ) t;
+    else
+        select array_agg(order_no) into changed
+        from (select order_no from inserted union select order_no from deleted) t;
+    end if;
+
+    if changed is not null then
+        perform product_sales_refresh(changed);
+    end if;
+
+    return null;
+end
+$$
+language plpgsql;
@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+-- A customer's orders, newest first, as the profile pages through them.
+-- It also serves every lookup by customer that orders_cust_no did.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_cust_no_date ON orders (cust_no, date, order_no);
+
+DROP INDEX CONCURRENTLY IF EXISTS orders_cust_no;
+
+ANALYZE orders;
@@ -0,0 +1,81 @@
+-- Price sales at the unit price captured on each line (see
+-- 010_order_totals.sql), as orders.order_total does, instead of at the
+-- current product price, so the analytics revenue and the order totals
+-- agree after a price change. Lines not backfilled yet still take the
+-- current price; backfill.py pricing them refreshes their sales.
+
+create or replace function product_sales_refresh(changed integer[])
+    returns void
+as
+$$
+begin
+    delete from product_sales where order_no = any(changed);
+
+    insert into product_sales
+    select c.sku, c.order_no, c.qty, c.qty * coalesce(c.unit_price, p.price), o.date,
+           extract(year from o.date), extract(month from o.date), extract(day from o.date),
+           trim(to_char(o.date, 'Day')), address_city(cust.address)
+    from contains c
+    join orders o on c.order_no = o.order_no
+    join customer cust on o.cust_no = cust.cust_no
+    join pay on o.order_no = pay.order_no
+    join product p on c.sku = p.sku
+    where c.order_no = any(changed);
+end
+$$
+language plpgsql;
+
+-- As in 010, but a line whose unit price changed is rebuilt too.
+create or replace function product_sales_sync()
+    returns trigger
+as
+$$
+declare
+    changed integer[];
+begin
+    if TG_OP = 'INSERT' then
+        select array_agg(distinct order_no) into changed from inserted;
+    elsif TG_OP = 'DELETE' then
+        select array_agg(distinct order_no) into changed from deleted;
+    elsif TG_TABLE_NAME = 'orders' then
+        select array_agg(distinct order_no) into changed
+        from (
+            (select order_no, cust_no, date from inserted
+             except select order_no, cust_no, date from deleted)
+            union all
+            (select order_no, cust_no, date from deleted
+             except select order_no, cust_no, date from inserted)
+        ) t;
+    elsif TG_TABLE_NAME = 'contains' then
+        select array_agg(distinct order_no) into changed
+        from (
+            (select order_no, sku, qty, unit_price from inserted
+             except select order_no, sku, qty, unit_price from deleted)
+            union all
+            (select order_no, sku, qty, unit_price from deleted
+             except select order_no, sku, qty, unit_price from inserted)
+        ) t;
+    else
+        select array_agg(order_no) into changed
+        from (select order_no from inserted union select order_no from deleted) t;
+    end if;
+
+    if changed is not null then
+        perform product_sales_refresh(changed);
+    end if;
+
+    return null;
+end
+$$
+language plpgsql;
+
+-- Sales no longer follow the current price.
+DROP TRIGGER IF EXISTS product_sales_price ON product;
+DROP FUNCTION IF EXISTS product_sales_price();
+
+UPDATE product_sales ps SET total_price = ps.qty * c.unit_price
+FROM contains c
+WHERE c.order_no = ps.order_no AND c.sku = ps.sku
+AND c.unit_price IS NOT NULL AND ps.total_price IS DISTINCT FROM ps.qty * c.unit_price;
+
+ANALYZE product_sales;
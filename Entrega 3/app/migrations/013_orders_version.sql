@@ -0,0 +1,82 @@
+-- Count and version the orders of each customer in row_count, so the
+-- profile can tell whether a customer's history changed with one lookup
+-- instead of reading it. Writes to orders (including the totals that
+-- contains keeps on them) and to pay bump the version of the customers
+-- they touch; only orders change the count.
+
+create or replace function count_customer_orders()
+    returns trigger
+as
+$$
+declare
+    counted integer := case when TG_TABLE_NAME = 'orders' then 1 else 0 end;
+begin
+    -- Customers are locked in order, so concurrent statements do not
+    -- deadlock on their counters.
+    if TG_OP = 'INSERT' then
+        insert into row_count(tbl, scope, total, version)
+        select 'orders', cust_no::text, counted * count(*), 1
+        from inserted where cust_no is not null group by cust_no order by 2
+        on conflict (tbl, scope) do update
+        set total = row_count.total + excluded.total, version = row_count.version + 1;
+    elsif TG_OP = 'DELETE' then
+        insert into row_count(tbl, scope, total, version)
+        select 'orders', cust_no::text, -counted * count(*), 1
+        from deleted where cust_no is not null group by cust_no order by 2
+        on conflict (tbl, scope) do update
+        set total = row_count.total + excluded.total, version = row_count.version + 1;
+    else
+        insert into row_count(tbl, scope, total, version)
+        select 'orders', cust_no::text, sum(n), 1
+        from (
+            select cust_no, counted as n from inserted
+            union all
+            select cust_no, -counted from deleted
+        ) t
+        where cust_no is not null group by cust_no order by 2
+        on conflict (tbl, scope) do update
+        set total = row_count.total + excluded.total, version = row_count.version + 1;
+    end if;
+
+    return null;
+end
+$$
+language plpgsql;
+
+create or replace trigger orders_count_insert
+after insert on orders
+referencing new table as inserted
+for each statement execute function count_customer_orders();
+
+create or replace trigger orders_count_update
+after update on orders
+referencing old table as deleted new table as inserted
+for each statement execute function count_customer_orders();
+
+create or replace trigger orders_count_delete
+after delete on orders
+referencing old table as deleted
+for each statement execute function count_customer_orders();
+
+create or replace trigger pay_count_insert
+after insert on pay
+referencing new table as inserted
+for each statement execute function count_customer_orders();
+
+create or replace trigger pay_count_update
+after update on pay
+referencing old table as deleted new table as inserted
+for each statement execute function count_customer_orders();
+
+create or replace trigger pay_count_delete
+after delete on pay
+referencing old table as deleted
+for each statement execute function count_customer_orders();
+
+-- Seed the counters while writers are kept out.
+LOCK TABLE orders, pay IN SHARE MODE;
+
+DELETE FROM row_count WHERE tbl = 'orders' AND scope <> '';
+
+INSERT INTO row_count(tbl, scope, total)
+SELECT 'orders', cust_no::text, count(*) FROM orders WHERE cust_no IS NOT NULL GROUP BY cust_no;
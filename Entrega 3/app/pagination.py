@@ -0,0 +1,199 @@
+"""Keyset (seek) pagination shared by the listing routes.
+
+Pages are addressed by an opaque "after" token holding the sort key of the
+last row of the previous page, so every page is read with an index seek
+instead of scanning and discarding the rows of all the earlier pages.
+"""
+import base64
+import json
+from collections import namedtuple
+
+from flask import url_for
+from psycopg import sql
+
+# How many page links are shown on each side of the current page.
+WINDOW = 2
+
+PageLink = namedtuple("PageLink", "page after")
+Page = namedtuple("Page", "rows number after links previous next")
+
+
+def encode_cursor(key):
+    """Turn the sort key of a row into an opaque "after" token."""
+
+    if key is None:
+        return None
+    data = json.dumps(list(key), default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, size):
+    """Return the sort key stored in a token, or None if it is not valid."""
+
+    if not token:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(key, list) or len(key) != size:
+        return None
+    if not all(isinstance(v, (int, float, str)) and not isinstance(v, bool) for v in key):
+        return None
+    return key
+
+
+def _seek(keys, op, prefix):
+    columns = sql.SQL(", ").join(map(sql.Identifier, keys))
+    values = sql.SQL(", ").join(
+        sql.Placeholder(f"{prefix}{i}") for i in range(len(keys))
+    )
+    return sql.SQL(" AND ({}) {} ({})").format(columns, sql.SQL(op), values)
+
+
+def fetch_page(
+    cur, table, columns, keys, after=None, page=1, per_page=5,
+    where=None, params=None, window=WINDOW, descending=False,
+):
+    """Read the page of ``table`` that starts after the ``after`` token.
+
+    Rows are ordered by ``keys``, which must be unique together, from the
+    smallest or, with ``descending``, from the largest. At most
+    ``per_page * window + 1`` rows are read forward and, when a cursor is
+    given, as many keys backward, so the cost of a page does not depend on
+    how deep it is. ``page`` is only used to label the links and is
+    corrected when the start of the table is in sight. ``table`` is a table
+    name or an SQL fragment such as a subquery with an alias.
+    """
+
+    steps = _page(
+        table, columns, keys, after, page, per_page, where, params, window, descending
+    )
+    try:
+        query = next(steps)
+        while True:
+            query = steps.send(cur.execute(*query).fetchall())
+    except StopIteration as done:
+        return done.value
+
+
+async def fetch_page_async(
+    cur, table, columns, keys, after=None, page=1, per_page=5,
+    where=None, params=None, window=WINDOW, descending=False,
+):
+    """fetch_page() on an async cursor."""
+
+    steps = _page(
+        table, columns, keys, after, page, per_page, where, params, window, descending
+    )
+    try:
+        query = next(steps)
+        while True:
+            await cur.execute(*query)
+            query = steps.send(await cur.fetchall())
+    except StopIteration as done:
+        return done.value
+
+
+def _page(table, columns, keys, after, page, per_page, where, params, window, descending):
+    """The work of fetch_page(): yields each query with its parameters and
+    is sent back the rows, so sync and async cursors can both run it."""
+
+    key = decode_cursor(after, len(keys))
+    if isinstance(table, str):
+        table = sql.Identifier(table)
+    params = dict(params or {})
+    where = where if where is not None else sql.SQL("TRUE")
+    names = sql.SQL(", ").join(map(sql.Identifier, keys))
+    forward, backward = ("DESC", "ASC") if descending else ("ASC", "DESC")
+    order, reverse = (
+        sql.SQL(", ").join(
+            sql.SQL("{} {}").format(sql.Identifier(k), sql.SQL(direction)) for k in keys
+        )
+        for direction in (forward, backward)
+    )
+    limit = per_page * window + 1
+
+    previous = []
+    if key is None:
+        after, number = None, 1
+    else:
+        params.update({f"_after{i}": v for i, v in enumerate(key)})
+        back = yield (
+            sql.SQL(
+                "SELECT {keys} FROM {table} WHERE {where}{seek} "
+                "ORDER BY {order} LIMIT %(_limit)s"
+            ).format(
+                keys=names,
+                table=table,
+                where=where,
+                seek=_seek(keys, ">=" if descending else "<=", "_after"),
+                order=reverse,
+            ),
+            {**params, "_limit": limit},
+        )
+
+        number = max(page, window + 2)
+        for k in range(1, window + 1):
+            if len(back) <= (k - 1) * per_page:
+                break
+            cursor = tuple(back[k * per_page]) if len(back) > k * per_page else None
+            previous.append(encode_cursor(cursor))
+            if cursor is None:
+                number = k + 1
+                break
+        if not back:
+            number = 1
+
+    rows = yield (
+        sql.SQL(
+            "SELECT {columns} FROM {table} WHERE {where}{seek} "
+            "ORDER BY {order} LIMIT %(_limit)s"
+        ).format(
+            columns=sql.SQL(", ").join(map(sql.Identifier, columns)),
+            table=table,
+            where=where,
+            seek=(
+                _seek(keys, "<" if descending else ">", "_after")
+                if key is not None else sql.SQL("")
+            ),
+            order=order,
+        ),
+        {**params, "_limit": limit},
+    )
+
+    following = [
+        encode_cursor(tuple(getattr(rows[k * per_page - 1], c) for c in keys))
+        for k in range(1, window + 1)
+        if len(rows) > k * per_page
+    ]
+
+    links = [PageLink(number - k, token) for k, token in enumerate(previous, 1)][::-1]
+    links.append(PageLink(number, after))
+    links += [PageLink(number + k, token) for k, token in enumerate(following, 1)]
+
+    return Page(
+        rows=rows[:per_page],
+        number=number,
+        after=after,
+        links=links,
+        previous=links[len(previous) - 1] if previous else None,
+        next=links[len(previous) + 1] if following else None,
+    )
+
+
+def link_header(page, endpoint, build=url_for, **values):
+    """Build an RFC 8288 ``Link`` header pointing at the neighbour pages.
+
+    ``build`` is the url_for() of the app serving the request.
+    """
+
+    links = []
+    for rel, link in (("prev", page.previous), ("next", page.next)):
+        if link is not None:
+            url = build(
+                endpoint, page=link.page, after=link.after, _external=True, **values
+            )
+            links.append(f'<{url}>; rel="{rel}"')
+    return ", ".join(links)
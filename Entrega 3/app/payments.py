@@ -0,0 +1,103 @@
+"""Payment of orders, one or thousands at a time.
+
+All the orders of a request are paid by one INSERT ... SELECT that takes
+only the orders that exist and belong to the customer given, and skips the
+ones already paid (ON CONFLICT DO NOTHING). Paying twice, e.g. after a
+double click, is therefore harmless, and a batch costs one statement on
+one connection.
+"""
+import os
+
+# Most orders one request may pay.
+MAX_ORDERS = int(os.environ.get("PAYMENTS_MAX", 10000))
+
+# Customer and order numbers are PostgreSQL integers.
+INTEGER_RANGE = range(-2**31, 2**31)
+
+# Every requested order with what became of it: "paid" now, "already paid"
+# before, or "unknown" if it is not an order of that customer.
+PAY = """
+    WITH request AS (
+        SELECT DISTINCT order_no, cust_no
+        FROM unnest(%(orders)s::integer[], %(customers)s::integer[]) AS r(order_no, cust_no)
+    ), paid AS (
+        INSERT INTO pay (order_no, cust_no)
+        SELECT o.order_no, o.cust_no
+        FROM request r
+        JOIN orders o ON o.order_no = r.order_no AND o.cust_no = r.cust_no
+        ON CONFLICT (order_no) DO NOTHING
+        RETURNING order_no
+    )
+    SELECT r.order_no, r.cust_no,
+           CASE
+               WHEN paid.order_no IS NOT NULL THEN 'paid'
+               WHEN o.order_no IS NOT NULL THEN 'already paid'
+               ELSE 'unknown'
+           END AS status
+    FROM request r
+    LEFT JOIN orders o ON o.order_no = r.order_no AND o.cust_no = r.cust_no
+    LEFT JOIN paid ON paid.order_no = r.order_no
+    ORDER BY r.order_no;
+"""
+
+
+def parse(body):
+    """The (cust_no, order_no) pairs of a JSON body such as
+    ``{"orders": [{"cust_no": 1, "order_no": 7}, ...]}``.
+
+    Raises ValueError if the body is not of that form.
+    """
+
+    orders = body.get("orders") if isinstance(body, dict) else None
+    if not isinstance(orders, list) or not orders:
+        raise ValueError('Expected {"orders": [{"cust_no": ..., "order_no": ...}, ...]}.')
+    if len(orders) > MAX_ORDERS:
+        raise ValueError(f"At most {MAX_ORDERS} orders can be paid at once.")
+    pairs = []
+    for order in orders:
+        try:
+            pair = (number(order["cust_no"]), number(order["order_no"]))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Not an order: {order!r}.") from None
+        pairs.append(pair)
+    return pairs
+
+
+def number(value):
+    """``value`` as a customer or order number.
+
+    Raises TypeError or ValueError if it is not one the database can hold.
+    """
+
+    # True and False are ints to Python, but not numbers of anything here.
+    if isinstance(value, bool):
+        raise TypeError(value)
+    number = int(value)
+    if number not in INTEGER_RANGE:
+        raise ValueError(value)
+    return number
+
+
+def params(pairs):
+    """The parameters of PAY for the (cust_no, order_no) ``pairs``."""
+
+    return {
+        "customers": [cust_no for cust_no, _ in pairs],
+        "orders": [order_no for _, order_no in pairs],
+    }
+
+
+def summary(rows):
+    """The order numbers of the PAY result, by status."""
+
+    result = {"paid": [], "already_paid": [], "unknown": []}
+    for order_no, _, status in rows:
+        result[status.replace(" ", "_")].append(order_no)
+    return result
+
+
+def pay(conn, pairs):
+    """Pay the (cust_no, order_no) ``pairs`` and return the order numbers by
+    status; see summary()."""
+
+    return summary(conn.execute(PAY, params(pairs)).fetchall())
@@ -0,0 +1,91 @@
+"""Counting of the SQL statements each request runs, to catch N+1 queries.
+
+When QUERY_LOG is set, every request keeps a QueryLog of the statements it
+ran and the connections it checked out. Tests can also wrap calls to the
+Flask test client in capture() to assert a query budget:
+
+    with querylog.capture(budget=app.QUERY_BUDGETS["customer_index"]):
+        client.get("/customers")
+"""
+import collections
+import contextlib
+import contextvars
+import os
+
+from flask import g
+from flask import has_request_context
+
+ENABLED = os.environ.get("QUERY_LOG", "") not in ("", "0")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request ran more statements than allowed, or repeated one."""
+
+
+class QueryLog:
+    """The statements and connection checkouts of one request."""
+
+    def __init__(self):
+        self.statements = []
+        self.checkouts = 0
+
+    @property
+    def repeated(self):
+        """Statements run more than once, which differ only by parameters."""
+
+        counts = collections.Counter(self.statements)
+        return {statement: n for statement, n in counts.items() if n > 1}
+
+    def record(self, statement):
+        self.statements.append(statement)
+
+    def check(self, budget=None, max_repeats=1, max_checkouts=None):
+        """Raise QueryBudgetExceeded if the log breaks the given limits."""
+
+        problems = []
+        if budget is not None and len(self.statements) > budget:
+            problems.append(f"{len(self.statements)} statements, budget is {budget}")
+        if max_checkouts is not None and self.checkouts > max_checkouts:
+            problems.append(f"{self.checkouts} connections taken, at most {max_checkouts}")
+        for statement, n in self.repeated.items():
+            if n > max_repeats:
+                problems.append(f"{n} x {statement}")
+        if problems:
+            raise QueryBudgetExceeded("; ".join(problems))
+
+
+_captures = contextvars.ContextVar("querylog_captures", default=())
+
+
+def _logs():
+    logs = list(_captures.get())
+    if has_request_context() and "querylog" in g:
+        logs.append(g.querylog)
+    return logs
+
+
+def record(statement):
+    """Note that a statement ran, in every log that is listening."""
+
+    for log in _logs():
+        log.record(statement)
+
+
+def checkout():
+    """Note that a connection was taken from the pool."""
+
+    for log in _logs():
+        log.checkouts += 1
+
+
+@contextlib.contextmanager
+def capture(budget=None, max_repeats=1, max_checkouts=None):
+    """Collect the statements run inside the block and check them on exit."""
+
+    log = QueryLog()
+    token = _captures.set(_captures.get() + (log,))
+    try:
+        yield log
+    finally:
+        _captures.reset(token)
+    log.check(budget, max_repeats, max_checkouts)
@@ -0,0 +1,69 @@
+"""Ranked product search for the catalog pages.
+
+Every word typed is matched as a prefix of a word of the product name or
+description, through the full-text index of migrations/008_product_search.sql;
+the whole text also matches SKUs that start with it. Matches are ranked
+with names above descriptions and an exact SKU first, and paged with the
+keyset cursors of pagination.py like the catalog.
+"""
+import collections
+import re
+
+from psycopg import sql
+from psycopg.rows import namedtuple_row
+
+import pagination
+
+# Longest search text taken into account.
+MAX_LENGTH = 100
+
+Product = collections.namedtuple("Product", "sku name description price")
+
+# Rows are ordered by score, the negated rank, so that fetch_page can seek
+# in ascending order; SKUs break ties. The score is a float8 so that it
+# reads back exactly from the cursor.
+MATCHES = sql.SQL(
+    """
+    (SELECT sku, name, description, price,
+            -(coalesce(ts_rank(product_document(name, description),
+                               to_tsquery('simple', %(words)s)), 0)::float8
+              + (upper(sku) = upper(%(text)s))::integer) AS score
+     FROM product
+     WHERE product_document(name, description) @@ to_tsquery('simple', %(words)s)
+        OR upper(sku) LIKE upper(%(prefix)s)) AS matches
+    """
+)
+
+
+def words(text):
+    """The tsquery matching every word of ``text`` as a prefix, or None."""
+
+    found = re.findall(r"\w+", text.lower())
+    if not found:
+        return None
+    return " & ".join(f"'{word}':*" for word in found)
+
+
+def _prefix(text):
+    escaped = re.sub(r"([\\%_])", r"\\\1", text)
+    return escaped + "%"
+
+
+def page(conn, text, after=None, page=1, per_page=5):
+    """The page of products matching ``text`` after ``after``, best first."""
+
+    text = text.strip()[:MAX_LENGTH]
+    # A text without words (e.g. only punctuation) can still be a SKU prefix.
+    params = {"words": words(text), "text": text, "prefix": _prefix(text)}
+    with conn.cursor(row_factory=namedtuple_row) as cur:
+        result = pagination.fetch_page(
+            cur,
+            MATCHES,
+            ("sku", "name", "description", "price", "score"),
+            ("score", "sku"),
+            after=after,
+            page=page,
+            per_page=per_page,
+            params=params,
+        )
+    return result._replace(rows=[Product(*row[:4]) for row in result.rows])
@@ -0,0 +1,105 @@
+"""Query budgets of the routes that used to run one query per row (N+1).
+
+Every request runs inside querylog.capture() with the budget app.py gives
+its endpoint and may take one pooled connection, so a route that goes over
+either, or repeats a statement, fails the build. The app also checks its
+own budgets in strict mode. The routes are pointed at rows that exist in
+the database at DATABASE_URL, and only a cart line is added and removed
+again; without a database, the module is skipped.
+
+    DATABASE_URL=... python -m pytest test_query_budgets.py
+"""
+import psycopg
+import pytest
+
+import dbpool
+import querylog
+
+try:
+    psycopg.connect(dbpool.DATABASE_URL, connect_timeout=3).close()
+except psycopg.Error as e:
+    pytest.skip(f"no database to run against: {e}", allow_module_level=True)
+
+import app as application
+
+JSON = {"Accept": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def client():
+    querylog.ENABLED = True
+    application.app.config["QUERY_BUDGET_STRICT"] = True
+    return application.app.test_client()
+
+
+@pytest.fixture(scope="module")
+def rows():
+    """A customer with an order, and a product with a supplier."""
+
+    with psycopg.connect(dbpool.DATABASE_URL) as conn:
+        order = conn.execute(
+            """
+            SELECT cust_no, order_no FROM orders
+            ORDER BY order_no
+            LIMIT 1;
+            """
+        ).fetchone()
+        sku = conn.execute(
+            "SELECT sku FROM supplier ORDER BY sku LIMIT 1;"
+        ).fetchone()
+    if order is None or sku is None:
+        pytest.skip("the database has no orders or suppliers")
+    return {"cust_no": order[0], "order_no": order[1], "sku": sku[0]}
+
+
+def request(client, endpoint, method, path, headers=None, data=None):
+    budget = application.QUERY_BUDGETS[endpoint]
+    with querylog.capture(budget=budget, max_checkouts=1) as log:
+        response = client.open(path, method=method, headers=headers, data=data)
+    assert response.status_code == 200, f"{path}: {response.status_code}"
+    assert log.statements, f"{path} ran no statement through the pool"
+    return response
+
+
+def get(client, endpoint, path, headers=None):
+    return request(client, endpoint, "GET", path, headers)
+
+
+def next_page(response):
+    return response.headers["Link"].split(">")[0].lstrip("<")
+
+
+@pytest.mark.parametrize("headers", [None, JSON], ids=["html", "json"])
+@pytest.mark.parametrize(
+    "endpoint, path",
+    [("customer_index", "/customers"), ("product_index", "/products")],
+)
+def test_listing(client, endpoint, path, headers):
+    response = get(client, endpoint, path, headers)
+    if headers is not None:
+        # A page deep in the listing costs the same as the first one.
+        get(client, endpoint, next_page(response), headers)
+
+
+@pytest.mark.parametrize(
+    "endpoint, path",
+    [
+        ("customer_profile", "/customers/{cust_no}/profile"),
+        ("order_status", "/customers/{cust_no}/{order_no}"),
+        ("make_order", "/customers/{cust_no}/make_order"),
+        ("supplier_edit", "/products/{sku}/edit_supplier"),
+        ("confirm_delete_c", "/customers/{cust_no}/confirm_delete"),
+        ("confirm_delete_p", "/products/{sku}/confirm_delete"),
+    ],
+)
+def test_page(client, rows, endpoint, path):
+    get(client, endpoint, path.format(**rows))
+
+
+@pytest.mark.parametrize("button", ["add", "remove"])
+def test_cart(client, rows, button):
+    # Changing the cart redraws the catalog, here from a page past the first.
+    after = next_page(client.get("/products", headers=JSON)).split("after=")[1]
+    path = f"/customers/{rows['cust_no']}/make_order?page=2&after={after}"
+    data = {"add": rows["sku"], rows["sku"]: 1} if button == "add" else {"remove": rows["sku"]}
+    request(client, "make_order", "POST", path, data=data)